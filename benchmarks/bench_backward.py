@@ -0,0 +1,37 @@
+if "__file__" in globals():
+    import os, sys
+
+    sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+import time
+import numpy as np
+from dezero import Variable
+
+
+def build_graph(n):
+    """构造约n个节点的计算图
+
+    每一项x * c都挂在一条很长的加法链上，反向传播时候选函数队列会同时持有大量函数，
+    用来观察调度器的开销
+    """
+    x = Variable(np.array(1.0))
+    y = x * 1.0
+    for i in range(n // 2 - 1):
+        y = y + x * float(i)
+    return x, y
+
+
+def bench(n):
+    x, y = build_graph(n)
+    start = time.perf_counter()
+    y.backward()
+    elapsed = time.perf_counter() - start
+    return elapsed
+
+
+if __name__ == "__main__":
+    sizes = [int(s) for s in sys.argv[1:]] or [10**4, 10**5, 10**6]
+    print("{:>10} {:>12} {:>14}".format("nodes", "backward(s)", "us per node"))
+    for n in sizes:
+        elapsed = bench(n)
+        print("{:>10} {:>12.3f} {:>14.3f}".format(n, elapsed, elapsed / n * 1e6))
@@ -0,0 +1,37 @@
+if "__file__" in globals():
+    import os, sys
+
+    sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+import time
+import numpy as np
+from dezero import Variable, using_config
+import dezero.functions as F
+
+
+def f(x, y):
+    return F.tanh(F.sin(x) * y + x**2) - F.cos(y)
+
+
+def ms_per_step(n, threshold, workers, seconds=1.0):
+    """n个元素的前向加反向传播的耗时(毫秒)"""
+    np.random.seed(0)
+    x, y = Variable(np.random.rand(n)), Variable(np.random.rand(n))
+    iters = 0
+    with using_config("elementwise_threshold", threshold), using_config("elementwise_workers", workers):
+        start = time.perf_counter()
+        while time.perf_counter() - start < seconds:
+            x.cleargrad()
+            y.cleargrad()
+            F.sum(f(x, y)).backward()
+            iters += 1
+    return (time.perf_counter() - start) / iters * 1e3
+
+
+if __name__ == "__main__":
+    workers = os.cpu_count() or 1
+    print("cpu_count", workers)
+    for n in (10**3, 10**5, 10**6, 10**7):
+        single = ms_per_step(n, None, workers)
+        chunked = ms_per_step(n, 1 << 16, workers)
+        print("{:>10} single {:9.3f} ms  chunked {:9.3f} ms  x{:.2f}".format(n, single, chunked, single / chunked))
@@ -0,0 +1,57 @@
+if "__file__" in globals():
+    import os, sys
+
+    sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+import time
+import numpy as np
+import dezero
+from dezero import Variable, codegen
+import dezero.functions as F
+
+
+np.random.seed(0)
+x_data = np.random.rand(100, 1)
+y_data = 5 + 2 * x_data + np.random.rand(100, 1)
+W = Variable(np.zeros((1, 1)), name="W")
+b = Variable(np.zeros(1), name="b")
+
+
+def mean_squared_error(x, y):
+    """steps/step42.py中的线性回归损失"""
+    y_pred = F.matmul(x, W) + b
+    diff = y_pred - y
+    return F.sum(diff**2) / len(diff)
+
+
+def us_per_call(step, seconds=1.0):
+    iters = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        step()
+        iters += 1
+    return (time.perf_counter() - start) / iters * 1e6
+
+
+def eager_step():
+    W.cleargrad()
+    b.cleargrad()
+    mean_squared_error(x_data, y_data).backward()
+
+
+if __name__ == "__main__":
+    jitted = dezero.jit(mean_squared_error)
+
+    def jit_step():
+        W.cleargrad()
+        b.cleargrad()
+        jitted(x_data, y_data).backward()
+
+    module = codegen.load(codegen.generate(mean_squared_error, x_data, y_data))
+    gy = np.array(1.0)
+
+    def generated_step():
+        module.vjp(x_data, y_data, W.data, b.data, gy)
+
+    for name, step in [("eager", eager_step), ("jit", jit_step), ("generated", generated_step)]:
+        print("{:>10} {:8.1f} us/step".format(name, us_per_call(step)))
@@ -0,0 +1,46 @@
+if "__file__" in globals():
+    import os, sys
+
+    sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+import timeit
+import numpy as np
+from dezero import Variable
+from dezero.core import _config
+
+
+class _ClassConfig:
+    """以前的实现：配置是全局的类属性"""
+
+    enable_backprop = True
+    inference = False
+    tape = None
+
+
+def lookup_class():
+    _ClassConfig.inference
+    _ClassConfig.tape
+    _ClassConfig.enable_backprop
+
+
+def lookup_context():
+    config = _config.get()
+    config.inference
+    config.tape
+    config.enable_backprop
+
+
+def best(stmt, number):
+    """多次测量取最快的一次，返回每次调用的纳秒数"""
+    return min(timeit.repeat(stmt, number=number, repeat=7)) / number * 1e9
+
+
+if __name__ == "__main__":
+    x = Variable(np.random.rand(4, 4))
+    call = best(lambda: x * x, 20000)
+    cls = best(lookup_class, 200000)
+    ctx = best(lookup_context, 200000)
+    print("Function.__call__ (mul, 4x4):  {:8.1f} ns".format(call))
+    print("config lookup, class attrs:    {:8.1f} ns".format(cls))
+    print("config lookup, contextvars:    {:8.1f} ns".format(ctx))
+    print("extra cost per call:           {:8.1f} ns ({:.2%})".format(ctx - cls, (ctx - cls) / call))
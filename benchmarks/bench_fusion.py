@@ -0,0 +1,53 @@
+if "__file__" in globals():
+    import os, sys
+
+    sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+import time
+import tracemalloc
+import numpy as np
+import dezero
+from dezero import Variable
+
+
+def goldstein(x, y):
+    z = (1 + (x + y + 1) ** 2 * (19 - 14 * x + 3 * x**2 - 14 * y + 6 * x * y + 3 * y**2)) * (
+        30 + (2 * x - 3 * y) ** 2 * (18 - 32 * x + 12 * x**2 + 48 * y - 36 * x * y + 27 * y**2)
+    )
+    return z
+
+
+def measure(fn, x, y, backward, repeat=5):
+    """返回(每次调用的毫秒数, 峰值内存MB)"""
+    fn(x, y)  # 预热，jit在这里完成追踪
+    tracemalloc.start()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        x.cleargrad()
+        y.cleargrad()
+        if backward:
+            fn(x, y).backward()
+        else:
+            with dezero.no_grad():
+                fn(x, y)
+    elapsed = (time.perf_counter() - start) / repeat
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed * 1e3, peak / 2**20
+
+
+if __name__ == "__main__":
+    np.random.seed(0)
+    n = 1_000_000
+    x = Variable(np.random.rand(n))
+    y = Variable(np.random.rand(n))
+    cases = [
+        ("eager", goldstein),
+        ("jit", dezero.jit(goldstein, optimize=False)),
+        ("jit+fusion", dezero.jit(goldstein)),
+    ]
+    for backward in (False, True):
+        print("forward+backward" if backward else "forward (no_grad)")
+        for name, fn in cases:
+            ms, mb = measure(fn, x, y, backward)
+            print("{:>12} {:8.1f} ms {:8.1f} MB".format(name, ms, mb))
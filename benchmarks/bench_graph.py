@@ -0,0 +1,73 @@
+if "__file__" in globals():
+    import os, sys
+
+    sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+import time
+import tracemalloc
+import numpy as np
+from dezero import Variable
+
+
+def goldstein(x, y):
+    z = (
+        1 + (x + y + 1) ** 2 * (19 - 14 * x + 3 * x**2 - 14 * y + 6 * x * y + 3 * y**2)
+    ) * (
+        30
+        + (2 * x - 3 * y) ** 2
+        * (18 - 32 * x + 12 * x**2 + 48 * y - 36 * x * y + 27 * y**2)
+    )
+    return z
+
+
+def rosenbrock(x0, x1):
+    y = 100 * (x1 - x0**2) ** 2 + (x0 - 1) ** 2
+    return y
+
+
+def count_funcs(y):
+    funcs, seen = [y.creator], {y.creator}
+    while funcs:
+        f = funcs.pop()
+        for x, creator, k in f.edges:
+            if creator is not None and creator not in seen:
+                seen.add(creator)
+                funcs.append(creator)
+    return len(seen)
+
+
+def bytes_per_node(f, repeat=200):
+    """保留repeat张计算图，用tracemalloc统计每个函数节点（含其输出变量）占用的字节数"""
+    x = Variable(np.array(1.0))
+    y = Variable(np.array(1.0))
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    graphs = [f(x, y) for _ in range(repeat)]
+    used = tracemalloc.get_traced_memory()[0] - base
+    tracemalloc.stop()
+    return used / (repeat * count_funcs(graphs[0]))
+
+
+def ops_per_sec(f, seconds=1.0):
+    """每秒能执行多少个函数节点（前向+反向）"""
+    x = Variable(np.array(1.0))
+    y = Variable(np.array(1.0))
+    n = count_funcs(f(x, y))
+    iters = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        x.cleargrad()
+        y.cleargrad()
+        f(x, y).backward()
+        iters += 1
+    return iters * n / (time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    print("{:>12} {:>16} {:>12}".format("", "bytes per node", "ops/s"))
+    for f in (goldstein, rosenbrock):
+        print(
+            "{:>12} {:>16.1f} {:>12.0f}".format(
+                f.__name__, bytes_per_node(f), ops_per_sec(f)
+            )
+        )
@@ -0,0 +1,64 @@
+if "__file__" in globals():
+    import os, sys
+
+    sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+import time
+import tracemalloc
+import numpy as np
+import dezero
+from dezero import Variable
+import dezero.functions as F
+
+np.random.seed(0)
+n = 10**6
+c = np.random.rand(n)
+
+
+def f(x):
+    """可分离的非二次凸函数，参数有一百万个，极小值点为c"""
+    d = x - c
+    return F.sum(F.tanh(d) * d + d**2)
+
+
+def double_backward(x, v):
+    """steps/step33.py的做法：create_graph=True得到二阶计算图，再对g·v反向传播一次"""
+    x = Variable(x)
+    f(x).backward(create_graph=True)
+    gx = x.grad
+    x.cleargrad()
+    F.sum(gx * v).backward()
+    return x.grad.data
+
+
+def peak_mb(fn, *args):
+    tracemalloc.start()
+    fn(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak / 2**20
+
+
+def ms(fn, *args, seconds=1.0):
+    iters = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        fn(*args)
+        iters += 1
+    return (time.perf_counter() - start) / iters * 1e3
+
+
+if __name__ == "__main__":
+    x, v = np.zeros(n), np.random.rand(n)
+    assert np.allclose(double_backward(x, v), dezero.hvp(f, x, v).data)
+    for name, fn in [("double backward", double_backward), ("hvp", lambda x, v: dezero.hvp(f, x, v))]:
+        print("H v with n={}: {:>15} {:7.1f} ms  peak {:6.1f} MB".format(n, name, ms(fn, x, v), peak_mb(fn, x, v)))
+
+    start = time.perf_counter()
+    iters = []
+    x_min = dezero.newton_cg(f, x, callback=iters.append)
+    print(
+        "newton_cg: {} iterations {:.2f} s  |x - c|_inf = {:.1e}".format(
+            len(iters), time.perf_counter() - start, np.abs(x_min - c).max()
+        )
+    )
@@ -0,0 +1,44 @@
+if "__file__" in globals():
+    import os, sys
+
+    sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+import contextlib
+import time
+import numpy as np
+import dezero
+from dezero import Variable
+import dezero.functions as F
+
+
+def mlp(x, W1, W2):
+    """小张量上的典型推理负载：每个运算的Python开销远大于NumPy本身的计算量"""
+    h = F.tanh(F.matmul(x, W1))
+    y = F.sin(F.matmul(h, W2)) * 2 + 1
+    return y
+
+
+def ops_per_sec(mode, seconds=1.0):
+    np.random.seed(0)
+    x = Variable(np.random.rand(4, 8))
+    W1 = Variable(np.random.rand(8, 8))
+    W2 = Variable(np.random.rand(8, 2))
+    n = 6  # mlp中的运算个数
+    iters = 0
+    with mode():
+        start = time.perf_counter()
+        while time.perf_counter() - start < seconds:
+            mlp(x, W1, W2)
+            iters += 1
+        elapsed = time.perf_counter() - start
+    return iters * n / elapsed
+
+
+if __name__ == "__main__":
+    modes = [
+        ("default", contextlib.nullcontext),
+        ("no_grad", dezero.no_grad),
+        ("inference_mode", dezero.inference_mode),
+    ]
+    for name, mode in modes:
+        print("{:>16} {:>12.0f} ops/s".format(name, ops_per_sec(mode)))
@@ -0,0 +1,56 @@
+if "__file__" in globals():
+    import os, sys
+
+    sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+import time
+import numpy as np
+import dezero
+from dezero import Variable
+import dezero.functions as F
+
+np.random.seed(0)
+
+
+def make(n, m):
+    """R^n -> R^m的两层网络"""
+    W1, W2 = np.random.randn(n, 64) * 0.1, np.random.randn(64, m) * 0.1
+
+    def f(x):
+        h = F.tanh(F.matmul(F.reshape(x, (1, n)), W1))
+        return F.reshape(F.sin(F.matmul(h, W2)), (m,))
+
+    return f
+
+
+def loop(f, x):
+    """逐个输出元素调用backward"""
+    xv = Variable(x)
+    y = f(xv)
+    rows = []
+    onehot = np.eye(y.size)
+    for i in range(y.size):
+        xv.cleargrad()
+        F.sum(y * onehot[i]).backward()
+        rows.append(xv.grad.data)
+    return np.array(rows)
+
+
+def ms(fn, *args, seconds=1.0):
+    iters = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        fn(*args)
+        iters += 1
+    return (time.perf_counter() - start) / iters * 1e3
+
+
+if __name__ == "__main__":
+    for n, m in ((500, 20), (20, 500), (200, 200)):
+        f, x = make(n, m), np.random.rand(n)
+        ref = loop(f, x)
+        times = ["loop {:8.2f} ms".format(ms(loop, f, x))]
+        for mode in ("reverse", "forward", "auto"):
+            assert np.allclose(dezero.jacobian(f, x, mode=mode).data, ref)
+            times.append("{} {:7.2f} ms".format(mode, ms(lambda: dezero.jacobian(f, x, mode=mode))))
+        print("n={:4} m={:4}  ".format(n, m) + "  ".join(times))
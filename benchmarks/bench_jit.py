@@ -0,0 +1,55 @@
+if "__file__" in globals():
+    import os, sys
+
+    sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+import time
+import numpy as np
+import dezero
+from dezero import Variable
+import dezero.functions as F
+
+
+def goldstein(x, y):
+    z = (1 + (x + y + 1) ** 2 * (19 - 14 * x + 3 * x**2 - 14 * y + 6 * x * y + 3 * y**2)) * (
+        30 + (2 * x - 3 * y) ** 2 * (18 - 32 * x + 12 * x**2 + 48 * y - 36 * x * y + 27 * y**2)
+    )
+    return z
+
+
+np.random.seed(0)
+x_data = np.random.rand(100, 1)
+y_data = 5 + 2 * x_data + np.random.rand(100, 1)
+W = Variable(np.zeros((1, 1)))
+b = Variable(np.zeros(1))
+
+
+def mean_squared_error(x, y):
+    """steps/step42.py中的线性回归损失"""
+    y_pred = F.matmul(x, W) + b
+    diff = y_pred - y
+    return F.sum(diff**2) / len(diff)
+
+
+def us_per_step(fn, args, params, seconds=1.0):
+    """每次前向加反向传播的耗时(微秒)"""
+    iters = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        for p in params:
+            p.cleargrad()
+        fn(*args).backward()
+        iters += 1
+    return (time.perf_counter() - start) / iters * 1e6
+
+
+if __name__ == "__main__":
+    x0, x1 = Variable(np.array(1.0)), Variable(np.array(1.0))
+    cases = [
+        ("goldstein", goldstein, (x0, x1), (x0, x1)),
+        ("step42", mean_squared_error, (x_data, y_data), (W, b)),
+    ]
+    for name, fn, args, params in cases:
+        eager = us_per_step(fn, args, params)
+        jitted = us_per_step(dezero.jit(fn), args, params)
+        print("{:>10} eager {:8.1f} us  jit {:8.1f} us  x{:.1f}".format(name, eager, jitted, eager / jitted))
@@ -0,0 +1,53 @@
+if "__file__" in globals():
+    import os, sys
+
+    sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+import time
+import numpy as np
+import dezero
+from dezero import Variable
+import dezero.functions as F
+
+grid = np.linspace(-7, 7, 200)  # steps/step34.py中的网格
+
+
+def f(a):
+    """一个标量参数、200个输出"""
+    a = F.broadcast_to(a, grid.shape)
+    return F.sin(a * grid) * F.tanh(a + grid)
+
+
+def reverse(a):
+    """反向模式：每个输出各做一次反向传播"""
+    x = Variable(a)
+    y = f(x)
+    column = np.empty(len(grid))
+    onehot = np.eye(len(grid))
+    for i in range(len(grid)):
+        x.cleargrad()
+        F.sum(y * onehot[i]).backward()  # 取出第i个输出
+        column[i] = x.grad.data
+    return column
+
+
+def forward(a):
+    """前向模式：一次前向传播得到全部输出对a的导数"""
+    _, ty = dezero.jvp(f, [a], [np.array(1.0)])
+    return ty.data
+
+
+def ms(fn, a, seconds=1.0):
+    iters = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        fn(a)
+        iters += 1
+    return (time.perf_counter() - start) / iters * 1e3
+
+
+if __name__ == "__main__":
+    a = np.array(0.5)
+    assert np.allclose(reverse(a), forward(a))
+    r, j = ms(reverse, a), ms(forward, a)
+    print("d f(a) / d a on {} outputs: reverse {:.3f} ms  jvp {:.3f} ms  x{:.0f}".format(len(grid), r, j, r / j))
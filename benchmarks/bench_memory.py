@@ -0,0 +1,63 @@
+if "__file__" in globals():
+    import os, sys
+
+    sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+import time
+import tracemalloc
+import numpy as np
+import dezero
+from dezero import Variable
+import dezero.functions as F
+
+np.random.seed(0)
+N, H = 200_000, 16
+x_data = np.random.rand(N, 1)
+y_data = np.sin(2 * np.pi * x_data) + np.random.rand(N, 1)
+W1 = Variable(0.01 * np.random.randn(1, H))
+b1 = Variable(np.zeros(H))
+W2 = Variable(0.01 * np.random.randn(H, 1))
+b2 = Variable(np.zeros(1))
+params = [W1, b1, W2, b2]
+
+
+def loss_fn(x, y):
+    """两层网络的回归损失，形状在训练中保持不变"""
+    h = F.tanh(F.matmul(x, W1) + b1)
+    y_pred = F.matmul(h, W2) + b2
+    diff = y_pred - y
+    return F.sum(diff**2) / len(diff)
+
+
+def train(fn, iters=10):
+    """返回(每步的毫秒数, 每步新分配内存的峰值MB)，预热时分配的arena不计算在内"""
+    fn(x_data, y_data)  # 预热，jit在这里完成追踪
+    tracemalloc.start()
+    peaks = 0
+    start = time.perf_counter()
+    for _ in range(iters):
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        for p in params:
+            p.cleargrad()
+        fn(x_data, y_data).backward()
+        for p in params:
+            p.data -= 0.1 * p.grad.data
+        peaks += tracemalloc.get_traced_memory()[1] - base
+    elapsed = (time.perf_counter() - start) / iters
+    tracemalloc.stop()
+    return elapsed * 1e3, peaks / iters / 2**20
+
+
+if __name__ == "__main__":
+    planned = dezero.jit(loss_fn)
+    cases = [
+        ("eager", loss_fn),
+        ("jit", dezero.jit(loss_fn, optimize=False)),
+        ("jit+plan", planned),
+    ]
+    for name, fn in cases:
+        ms, mb = train(fn)
+        print("{:>10} {:8.1f} ms/step {:8.1f} MB allocated".format(name, ms, mb))
+    program = planned.programs.values()[0]
+    print("jit+plan arena (reused every step): {:.1f} MB".format(program.plans[True].nbytes / 2**20))
@@ -0,0 +1,52 @@
+if "__file__" in globals():
+    import os, sys
+
+    sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+import os
+import time
+import numpy as np
+from dezero import Variable
+import dezero.functions as F
+
+
+def goldstein(x, y):
+    z = (1 + (x + y + 1) ** 2 * (19 - 14 * x + 3 * x**2 - 14 * y + 6 * x * y + 3 * y**2)) * (
+        30 + (2 * x - 3 * y) ** 2 * (18 - 32 * x + 12 * x**2 + 48 * y - 36 * x * y + 27 * y**2)
+    )
+    return z
+
+
+def two_heads(x, W1, W2):
+    """两个互不依赖的分支，各自包含较大的矩阵乘法"""
+    return F.sum(F.tanh(F.matmul(x, W1))) + F.sum(F.sin(F.matmul(x, W2)))
+
+
+def ms_per_backward(build, params, workers, repeat=5):
+    total = 0.0
+    for _ in range(repeat):
+        for p in params:
+            p.cleargrad()
+        y = build()
+        start = time.perf_counter()
+        y.backward(workers=workers)
+        total += time.perf_counter() - start
+    return total / repeat * 1e3
+
+
+if __name__ == "__main__":
+    np.random.seed(0)
+    x = Variable(np.random.rand(2_000_000))
+    y = Variable(np.random.rand(2_000_000))
+    h = Variable(np.random.rand(2000, 1000))
+    W1 = Variable(np.random.rand(1000, 1000))
+    W2 = Variable(np.random.rand(1000, 1000))
+    cases = [
+        ("goldstein", lambda: goldstein(x, y), [x, y]),
+        ("two_heads", lambda: two_heads(h, W1, W2), [h, W1, W2]),
+    ]
+    print("cpus:", os.cpu_count())
+    for name, build, params in cases:
+        for workers in (None, 1, 2, 4, 8):
+            ms = ms_per_backward(build, params, workers)
+            print("{:>10} workers={!s:>4} {:8.1f} ms".format(name, workers, ms))
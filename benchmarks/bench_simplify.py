@@ -0,0 +1,61 @@
+if "__file__" in globals():
+    import os, sys
+
+    sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+import time
+import numpy as np
+from dezero import Variable
+from dezero.core import Config
+import dezero.functions as F
+
+
+def repeated_backward(k):
+    """steps/step35.py的做法：对tanh反复backward(create_graph=True)，返回k阶导数(Variable)"""
+    x = Variable(np.array(1.0))
+    y = F.tanh(x)
+    y.backward(create_graph=True)
+    for i in range(k - 1):
+        gx = x.grad
+        x.cleargrad()
+        gx.backward(create_graph=True)
+    return x.grad
+
+
+def count_nodes(y):
+    """y的计算图中Function的个数"""
+    seen = set()
+    stack = [y.creator]
+    while stack:
+        f = stack.pop()
+        if f is None or f in seen:
+            continue
+        seen.add(f)
+        stack.extend(creator for _, creator, _ in f.edges)
+    return len(seen)
+
+
+def ms(fn, *args, seconds=0.5):
+    iters = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        fn(*args)
+        iters += 1
+    return (time.perf_counter() - start) / iters * 1e3
+
+
+if __name__ == "__main__":
+    print("step35 tanh: k阶导数的计算图大小和求出它的时间")
+    for k in range(2, 7):
+        row = []
+        for simplify in (False, True):
+            Config.simplify = simplify
+            gx = repeated_backward(k)
+            row.append((count_nodes(gx), ms(repeated_backward, k), float(gx.data)))
+        (n0, t0, v0), (n1, t1, v1) = row
+        assert np.isclose(v0, v1)
+        print(
+            "  k={}  nodes {:4d} -> {:4d}   {:7.3f} ms -> {:7.3f} ms  (x{:.2f})".format(
+                k, n0, n1, t0, t1, t0 / t1
+            )
+        )
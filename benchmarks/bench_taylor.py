@@ -0,0 +1,46 @@
+if "__file__" in globals():
+    import os, sys
+
+    sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+import time
+import numpy as np
+import dezero
+from dezero import Variable
+import dezero.functions as F
+
+
+def repeated_backward(f, x, k):
+    """steps/step34.py和step35.py的做法：反复backward(create_graph=True)求出k阶导数"""
+    x = Variable(x)
+    y = f(x)
+    y.backward(create_graph=True)
+    for i in range(k - 1):
+        gx = x.grad
+        x.cleargrad()
+        gx.backward(create_graph=True)
+    return x.grad.data
+
+
+def ms(fn, *args, seconds=0.5):
+    iters = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        fn(*args)
+        iters += 1
+    return (time.perf_counter() - start) / iters * 1e3
+
+
+if __name__ == "__main__":
+    cases = [
+        ("step34 sin", F.sin, np.linspace(-7, 7, 200)),
+        ("step35 tanh", F.tanh, np.array(1.0)),
+    ]
+    for name, f, x in cases:
+        for k in range(1, 7):
+            assert np.allclose(repeated_backward(f, x, k), dezero.taylor(f, x, k)[k].data)
+            print(
+                "{:>12} order {}: repeated backward {:9.3f} ms  taylor {:7.3f} ms".format(
+                    name, k, ms(repeated_backward, f, x, k), ms(lambda: dezero.taylor(f, x, k))
+                )
+            )
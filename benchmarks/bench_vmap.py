@@ -0,0 +1,59 @@
+if "__file__" in globals():
+    import os, sys
+
+    sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+import time
+import numpy as np
+import dezero
+from dezero import Variable
+import dezero.functions as F
+
+np.random.seed(0)
+N, D, H = 256, 10, 32
+x_data = np.random.rand(N, D)
+t_data = np.random.rand(N, 1)
+W1, b1 = np.random.randn(D, H) * 0.1, np.zeros(H)
+W2, b2 = np.random.randn(H, 1) * 0.1, np.zeros(1)
+
+
+def loss(W1, b1, W2, b2, x, t):
+    """一个样本的两层网络的平方误差"""
+    h = F.tanh(F.matmul(F.reshape(x, (1, D)), W1) + b1)
+    y = F.matmul(h, W2) + b2
+    return F.sum((y - F.reshape(t, (1, 1))) ** 2)
+
+
+def per_sample_loop():
+    """逐个样本调用backward，得到每个样本对W1的梯度的范数"""
+    params = [Variable(p) for p in (W1, b1, W2, b2)]
+    norms = np.empty(N)
+    for i in range(N):
+        for p in params:
+            p.cleargrad()
+        loss(*params, x_data[i], t_data[i]).backward()
+        norms[i] = np.linalg.norm(params[0].grad.data)
+    return norms
+
+
+batched = dezero.vmap(loss, in_axes=(None, None, None, None, 0, 0))
+
+
+def per_sample_vmap():
+    gW1 = batched.grad(W1, b1, W2, b2, x_data, t_data)[0].data
+    return np.linalg.norm(gW1.reshape(N, -1), axis=1)
+
+
+def ms(fn, seconds=1.0):
+    iters = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        fn()
+        iters += 1
+    return (time.perf_counter() - start) / iters * 1e3
+
+
+if __name__ == "__main__":
+    assert np.allclose(per_sample_loop(), per_sample_vmap())
+    loop, vmapped = ms(per_sample_loop), ms(per_sample_vmap)
+    print("per-sample grad norms, N={}: loop {:.2f} ms  vmap {:.2f} ms  x{:.0f}".format(N, loop, vmapped, loop / vmapped))
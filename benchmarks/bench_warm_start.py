@@ -0,0 +1,37 @@
+if "__file__" in globals():
+    import os, sys
+
+    sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+import tempfile
+import time
+import numpy as np
+import dezero
+from dezero import Variable
+import dezero.functions as F
+
+
+def deep_mlp(x, *params):
+    """参数作为实参传入，追踪结果可以保存到磁盘"""
+    h = x
+    for W in params:
+        h = F.tanh(F.matmul(h, W)) * 0.5 + F.sin(h) ** 2
+    return F.sum(h)
+
+
+def first_call_ms(cache_dir, args):
+    """新建jit函数(相当于新启动的进程)，返回第一次调用的毫秒数"""
+    f = dezero.jit(deep_mlp, cache_dir=cache_dir)
+    start = time.perf_counter()
+    f(*args)
+    return (time.perf_counter() - start) * 1e3
+
+
+if __name__ == "__main__":
+    np.random.seed(0)
+    args = [Variable(np.random.rand(16, 32))]
+    args += [Variable(np.random.rand(32, 32)) for _ in range(50)]
+    with tempfile.TemporaryDirectory() as cache_dir:
+        print("{:>12} {:8.1f} ms".format("no cache", first_call_ms(None, args)))
+        print("{:>12} {:8.1f} ms".format("cold", first_call_ms(cache_dir, args)))
+        print("{:>12} {:8.1f} ms".format("warm", first_call_ms(cache_dir, args)))
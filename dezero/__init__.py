@@ -1,3 +1,5 @@
+__version__ = "0.1.0"
+
 is_simple_core = False
 
 if is_simple_core:
@@ -10,13 +12,25 @@ if is_simple_core:
     from dezero.core_simple import setup_variable
 else:
     from dezero.core import Variable
+    from dezero.core import Constant
     from dezero.core import Function
     from dezero.core import using_config
     from dezero.core import no_grad
+    from dezero.core import inference_mode
     from dezero.core import as_array
     from dezero.core import as_variable
     from dezero.core import setup_variable
+    from dezero.core import BackwardPlan
     
     import dezero.functions
+    import dezero.parallel
+    from dezero.tape import Tape
+    from dezero.jit import jit
+    from dezero.transforms import jvp
+    from dezero.transforms import vmap
+    from dezero.transforms import hvp
+    from dezero.transforms import jacobian
+    from dezero.transforms import taylor
+    from dezero.optimize import newton_cg
 
 setup_variable()
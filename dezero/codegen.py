@@ -0,0 +1,149 @@
+import inspect
+import keyword
+import re
+import types
+
+from dezero import utils
+from dezero import passes
+from dezero.core import Function, Variable, as_array
+from dezero.jit import Program
+
+# 生成的代码中可能用到的辅助函数，直接复制它们的源代码(只依赖numpy)
+_HELPERS = (utils.sum_to, utils.reshape_sum_backward)
+_RESERVED = set(["np", "forward", "vjp"] + [h.__name__ for h in _HELPERS])
+
+
+def _identifier(name, used):
+    """name可以作为生成代码中的变量名时返回name，否则返回None"""
+    if name is None or not name.isidentifier() or keyword.iskeyword(name):
+        return None
+    if name in used or name in _RESERVED or re.fullmatch(r"(v|g|c|gy)\d*", name):
+        return None  # 与槽位、梯度和常量的变量名冲突
+    return name
+
+
+def _input_names(fn, n_args, captured):
+    """参数的名字取自fn的签名，captured变量的名字取自Variable.name"""
+    names = []
+    try:
+        params = list(inspect.signature(fn).parameters.values())
+    except (TypeError, ValueError):
+        params = []
+    for i in range(n_args):
+        name = params[i].name if i < len(params) else None
+        names.append(_identifier(name, names) or "x{}".format(i))
+    for i, x in enumerate(captured):
+        names.append(_identifier(x.name, names) or "p{}".format(i))
+    return names
+
+
+def _constant(x):
+    if x.ndim == 0:
+        return "np.array({!r}, dtype={!r})".format(x.item(), x.dtype.str)
+    return "np.array({!r}, dtype={!r})".format(x.tolist(), x.dtype.str)
+
+
+def generate(fn, *args):
+    """追踪fn(*args)并生成只依赖numpy的Python模块的源代码
+
+    生成的模块包含两个函数：
+        forward(参数..., captured变量...)：返回fn的输出
+        vjp(参数..., captured变量..., 输出的梯度...)：重新计算前向传播，返回所有输入的梯度，
+        不需要梯度(与输出无关)的输入返回None
+    fn引用的外部变量(比如全局的参数)会成为额外的输入，名字取自Variable.name。
+    只支持实现了forward_source和vjp_source的Function
+    """
+    args = [x if isinstance(x, Variable) else Variable(as_array(x)) for x in args]
+    program = Program(fn, args)
+    passes.fold_constants(program)
+    passes.eliminate_common_subexpressions(program)
+
+    names = _input_names(fn, len(args), program.captured)
+    slot_names = {}
+    for s, name in zip(program.input_slots, names):
+        if s is not None and s not in slot_names:
+            slot_names[s] = name
+
+    def v(s):
+        return slot_names.get(s, "v{}".format(s))
+
+    for f, _, _ in program.nodes:
+        if type(f).forward_source is Function.forward_source:
+            raise NotImplementedError(
+                "codegen: {} does not implement forward_source".format(type(f).__name__)
+            )
+
+    lines = [
+        '"""由dezero.codegen根据{}生成，只依赖numpy"""'.format(getattr(fn, "__name__", "fn")),
+        "import numpy as np",
+        "",
+    ]
+    for helper in _HELPERS:
+        lines += ["", inspect.getsource(helper).rstrip(), ""]
+    lines.append("")
+    for s in sorted(program.consts):
+        slot_names[s] = "c{}".format(s)
+        lines.append("c{} = {}".format(s, _constant(program.consts[s])))
+
+    forward_body = []
+    for f, ins, outs in program.nodes:
+        expr = f.forward_source([v(s) for s in ins])
+        forward_body.append("    {} = {}".format(", ".join(v(s) for s in outs), expr))
+    results = [v(s) for s in program.output_slots]
+
+    lines += ["", "", "def forward({}):".format(", ".join(names))]
+    lines += forward_body
+    lines.append("    return {}".format(", ".join(results)))
+
+    # 只对能影响到输出、并且依赖于输入的槽位求梯度
+    requires = set(s for s in program.input_slots if s is not None)
+    for f, ins, outs in program.nodes:
+        if any(s in requires for s in ins):
+            requires.update(outs)
+
+    gy_names = ["gy"] if len(results) == 1 else ["gy{}".format(i) for i in range(len(results))]
+    backward_body = []
+    grads = {}
+
+    def accumulate(s, expr):
+        g = "g{}".format(s)
+        if s in grads:
+            backward_body.append("    {} = {} + {}".format(g, g, expr))
+        else:
+            backward_body.append("    {} = {}".format(g, expr))
+            grads[s] = g
+
+    for s, gy in zip(program.output_slots, gy_names):
+        accumulate(s, gy)
+    for f, ins, outs in reversed(program.nodes):
+        if not any(s in grads for s in outs):
+            continue
+        if len(outs) != 1:
+            raise NotImplementedError("codegen: Functions with multiple outputs are not supported")
+        exprs = f.vjp_source([v(s) for s in ins], [v(s) for s in outs], [grads[outs[0]]])
+        for s, expr in zip(ins, exprs):
+            if s in requires:
+                accumulate(s, expr)
+
+    lines += ["", "", "def vjp({}):".format(", ".join(names + gy_names))]
+    lines += forward_body
+    lines += backward_body
+    gxs = [grads.get(s, "None") if s is not None else "None" for s in program.input_slots]
+    lines.append("    return {}".format(", ".join(gxs) + ("," if len(gxs) == 1 else "")))
+    return "\n".join(lines) + "\n"
+
+
+def export(fn, path, *args):
+    """把generate(fn, *args)生成的代码写入path，返回源代码"""
+    source = generate(fn, *args)
+    with open(path, "w") as f:
+        f.write(source)
+    return source
+
+
+def load(source, name="dezero_generated"):
+    """执行生成的源代码，返回对应的模块对象"""
+    module = types.ModuleType(name)
+    exec(compile(source, "<{}>".format(name), "exec"), module.__dict__)
+    return module
+
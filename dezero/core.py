@@ -1,4 +1,8 @@
 import contextlib
+import contextvars
+import copy
+import heapq
+import itertools
 import numpy as np
 import unittest
 import weakref
@@ -6,11 +10,52 @@ import weakref
 import dezero
 
 
-class Config:
+class _ConfigState:
+    """一个上下文中的配置，类属性是默认值。配置对象不会被原地修改，修改时总是复制一份新的"""
+
     enable_backprop = True
+    inference = False  # 推理模式，见inference_mode
+    tape = None  # 正在记录的dezero.tape.Tape，见Function.__call__
+    # 元素个数不少于这个值的逐元素运算分块在线程池中执行(见dezero.parallel.elementwise)，None表示不分块。
+    # dezero.jit编译的运算不分块
+    elementwise_threshold = None
+    elementwise_workers = 4
+    tangents = None  # 前向模式自动微分的切向量表，见dezero.transforms.jvp
+    simplify = True  # backward(create_graph=True)构建梯度的计算图时化简恒等式、折叠常量，见_simplify
+    subexpressions = None  # 化简时为本次反向传播中创建过的运算 -> 输出，由Variable.backward设置
+
+    def __init__(self):
+        # 把默认值复制到实例字典中，Function.__call__里的属性查找可以直接命中实例
+        for name, value in vars(_ConfigState).items():
+            if not name.startswith("_") and not callable(value):
+                setattr(self, name, value)
+
+    def replace(self, name, value):
+        state = object.__new__(_ConfigState)
+        state.__dict__.update(self.__dict__)
+        setattr(state, name, value)
+        return state
+
+
+# 配置保存在contextvars中，每个线程和asyncio任务各自独立，
+# 一个线程进入no_grad()不会影响其他线程的计算图构建；新线程总是从默认配置开始
+_config = contextvars.ContextVar("dezero_config", default=_ConfigState())
+
+
+class _ConfigMeta(type):
+    def __getattr__(cls, name):
+        return getattr(_config.get(), name)
+
+    def __setattr__(cls, name, value):
+        _config.set(_config.get().replace(name, value))
+
+
+class Config(metaclass=_ConfigMeta):
+    """当前上下文的配置，比如Config.enable_backprop，读写都只作用于当前线程或asyncio任务"""
 
 
 class Variable:
+    __slots__ = ("data", "name", "grad", "creator", "generation", "__weakref__")
     __array_proority__ = 200
 
     def __init__(self, data, name=None):
@@ -28,57 +73,36 @@ class Variable:
         self.creator = func
         self.generation = func.generation + 1
 
-    def backward(self, retain_grad=False, create_graph=False):
+    def backward(
+        self,
+        retain_grad=False,
+        create_graph=False,
+        plan=None,
+        retain_graph=True,
+        workers=None,
+    ):
         """反向传播过程
 
         retain_grad: 是否保留中间过程的grad, 默认为False不保存
         create_graph: 是否创建反向传播计算图, 默认为False不创建
+        plan: BackwardPlan实例, 计算图结构不变时复用其中记录的函数处理顺序
+        retain_graph: 是否保留计算图, 为False时每个函数求出梯度后立即释放它保存的输入和输出,
+            降低反向传播过程中的内存峰值, 之后不能再对这张计算图进行反向传播
+        workers: 线程数, 不为None时在线程池中并行执行互不依赖的函数(见dezero.parallel), 此时不使用plan
         """
 
         if self.grad is None:
             # self.grad = np.ones_like(self.data)
-            self.grad = Variable(np.ones_like(self.data))
-
-        funcs = []
-        seen_set = set()
-
-        def add_func(f):
-            if f not in seen_set:
-                funcs.append(f)
-                seen_set.add(f)
-                funcs.sort(key=lambda x: x.generation)
-
-        add_func(self.creator)
-
-        while funcs:
-            f = funcs.pop()
-            # 开始反向传播计算
-            gys = [
-                output().grad for output in f.outputs
-            ]  # 将Variable的实例变量grad汇总在列表中
-
-            with using_config(
-                "enable_backprop", create_graph
-            ):  # 配合Function::forward中的`if Config.enable_backprop:`来创建反向连接
-                gxs = f.backward(
-                    *gys
-                )  # 进行实际的反向传播运算，在前向过程的输出就是后向过程的输入
-                if not isinstance(gxs, tuple):
-                    gxs = (gxs,)
-                for x, gx in zip(
-                    f.inputs, gxs
-                ):  # 从输出端开始传播的导数（gx）设置魏函数的输入变量（f.input）的grad
-                    if x.grad is None:
-                        x.grad = gx
-                    else:
-                        x.grad = x.grad + gx  # 累积多个梯度
-
-                    if x.creator is not None:
-                        add_func(x.creator)
-
-                if not retain_grad:  # 不保留中间梯度时，要清空所有已经用过的grad
-                    for y in f.outputs:
-                        y().grad = None
+            self.grad = Constant(np.ones_like(self.data))
+
+        simplify = create_graph and _config.get().simplify
+        with using_config("subexpressions", {}) if simplify else contextlib.nullcontext():
+            if workers is not None:
+                dezero.parallel.backprop(
+                    [(self, self.grad)], retain_grad, create_graph, retain_graph, workers
+                )
+                return
+            _backprop([(self, self.grad)], retain_grad, create_graph, plan, retain_graph)
 
     def cleargrad(self):
         self.grad = None
@@ -127,46 +151,526 @@ class Variable:
         return dezero.functions.sum(self, axis, keepdims)
 
 
+class Constant(Variable):
+    """不需要梯度的常量：Function的输入中不是Variable的数值(比如1 - y中的1)和反向传播的初始梯度
+
+    反向传播不会为它累积梯度，化简梯度的计算图时(见_simplify)可以把它当作已知的数值
+    """
+
+    __slots__ = ()
+
+
 def as_variable(obj):
     if isinstance(obj, Variable):
         return obj
     return Variable(obj)
 
 
+def _backprop(
+    roots,
+    retain_grad=False,
+    create_graph=False,
+    plan=None,
+    retain_graph=True,
+    inputs=None,
+    needed=None,
+    leaves=False,
+):
+    """反向传播的执行过程，参数的含义见Variable.backward
+
+    roots: [(变量, 变量的梯度)]，从这些变量开始反向传播
+    inputs: 为None时把梯度累积到叶子变量的grad上；否则只求inputs中各个变量的梯度并以列表的形式返回，
+        不修改任何变量的grad，也不会越过inputs继续向前传播。同一个变量多次出现时只在第一次返回梯度，
+        其余为None，调用者把它们分别累积时不会重复计算
+    needed: 不为None时只执行其中的函数(比如依赖于inputs的函数)，其余分支的梯度不会被计算
+    leaves: inputs不为None时，仍然把梯度累积到inputs以外的叶子变量的grad上
+        (Checkpoint在局部计算图上反向传播时，fn引用的外部参数也需要梯度)
+    """
+    # 中间变量的梯度以(创建者, 输出序号)为键暂存，这样即使中间变量已经被释放，梯度也不会丢失
+    grads = {}
+    owned = {}  # 本次反向传播中新分配的梯度缓冲区，见_accumulate_grad
+    pending = {}  # 释放计算图时，让需要读取输出的创建者(比如Tanh)处理完之前输出变量一直存活
+    stops = None
+    if inputs is not None:
+        stops = {}
+        for i, x in enumerate(inputs):
+            stops.setdefault(_edge_key(x), i)  # 重复的变量记录第一次出现的位置
+
+    creators = []
+    for y, gy in roots:
+        key = _edge_key(y)
+        grads[key] = _accumulate_grad(grads.get(key), gy, create_graph, owned)
+        if y.creator is not None and (stops is None or key not in stops):
+            creators.append(y.creator)
+
+    if len(creators) != 1:
+        plan = None  # 计划只记录从一个函数开始的处理顺序
+    funcs = None
+    if plan is not None:
+        funcs = plan.resolve(creators[0])  # 结构不一致时返回None，重新记录
+    if needed is not None:
+        creators = [f for f in creators if f in needed]
+        plan = None
+        funcs = None
+    if funcs is None:
+        funcs = _topological_order(creators, plan, stops, needed)
+
+    for f in funcs:
+        # 开始反向传播计算
+        gys = [
+            grads.pop((f, i), None) for i in range(len(f.outputs))
+        ]  # 将输出变量的grad汇总在列表中
+        for output, gy in zip(f.outputs, gys):
+            owned.pop(id(gy), None)
+            y = output()
+            if y is not None:  # 保留中间梯度时写回输出变量，否则清空
+                y.grad = gy if retain_grad else None
+
+        with using_config(
+            "enable_backprop", create_graph
+        ):  # 配合Function::forward中的`if Config.enable_backprop:`来创建反向连接
+            gxs = f.backward(
+                *gys
+            )  # 进行实际的反向传播运算，在前向过程的输出就是后向过程的输入
+            if not isinstance(gxs, tuple):
+                gxs = (gxs,)
+            for (x, creator, k), gx in zip(
+                f.edges, gxs
+            ):  # 从输出端开始传播的导数（gx）设置魏函数的输入变量（f.input）的grad
+                if gx is None:
+                    continue
+                if creator is None and stops is None:  # 叶子变量直接累积到grad上
+                    if type(x) is not Constant:
+                        x.grad = _accumulate_grad(x.grad, gx, create_graph, owned)
+                    continue
+                key = x if creator is None else (creator, k)
+                if creator is None and key not in stops:
+                    if leaves and type(x) is not Constant:
+                        x.grad = _accumulate_grad(x.grad, gx, create_graph, owned)
+                    continue  # 只求inputs的梯度时，其余叶子变量的梯度不需要
+                grads[key] = _accumulate_grad(grads.get(key), gx, create_graph, owned)
+                if not retain_graph and creator is not None and "outputs" in creator.saves:
+                    pending[key] = x
+
+        if not retain_graph:  # 释放保存的输入和输出，使前向传播的中间结果能够尽早回收
+            for i in range(len(f.outputs)):
+                pending.pop((f, i), None)
+            f.inputs = None
+            f.edges = None
+            f.outputs = None
+
+    if stops is not None:
+        gxs = []
+        for i, x in enumerate(inputs):
+            key = _edge_key(x)
+            gxs.append(grads.get(key) if stops[key] == i else None)
+        return gxs
+
+
+def _edge_key(x):
+    """反向传播过程中暂存变量x的梯度时使用的键：叶子变量为其本身，中间变量为(创建者, 输出序号)"""
+    if x.creator is None:
+        return x
+    return x.creator, _output_index(x)
+
+
+def _accumulate_grad(grad, gx, create_graph, owned):
+    """把gx累积到grad上并返回累积结果
+
+    创建计算图时通过Add累积。否则尽量在已经分配的缓冲区上原地相加：
+    grad可能与其他变量共享同一个数组(比如Add.backward直接返回gy)，不能直接修改，
+    所以第一次累积时分配一块新的缓冲区并登记在owned(id -> Variable)中，之后在这块缓冲区上原地累加
+    """
+    if grad is None:
+        return gx
+    if create_graph or _config.get().tangents is not None:  # 前向模式需要通过Add传播切向量
+        return grad + gx
+    if id(grad) in owned:
+        buf = grad.data
+        if (
+            np.broadcast_shapes(buf.shape, gx.shape) == buf.shape
+            and np.result_type(buf, gx.data) == buf.dtype
+        ):
+            np.add(buf, gx.data, out=buf)
+            return grad
+        del owned[id(grad)]
+    grad = Variable(as_array(grad.data + gx.data))
+    owned[id(grad)] = grad
+    return grad
+
+
+def _output_index(x):
+    """x是其创建者的第几个输出，创建者的计算图已经被释放时返回None"""
+    outputs = x.creator.outputs
+    if outputs is None:
+        return None
+    for i, output in enumerate(outputs):
+        if output() is x:
+            return i
+    raise RuntimeError("{} is not an output of its creator".format(x))
+
+
+def _topological_order(creators, plan=None, stops=None, needed=None):
+    """按照generation从大到小的顺序依次取出creators及其之前的所有函数
+
+    plan不为None时，同时把处理顺序记录到plan中(只支持一个起点)
+    stops不为None时，不再越过stops中的变量(以_edge_key为键)继续向前查找
+    needed不为None时，只查找其中的函数
+    """
+    funcs = []  # 以generation为键的优先队列（heapq是小顶堆，所以存入负的generation）
+    seen_set = set()
+    counter = itertools.count()  # generation相同时按加入顺序出队，保证顺序是确定的
+    steps = {}  # 函数 -> 在处理顺序中的位置，仅在记录plan时使用
+    types, targets = [], []
+
+    def add_func(f):
+        if f not in seen_set:
+            heapq.heappush(funcs, (-f.generation, next(counter), f))
+            seen_set.add(f)
+
+    for creator in creators:
+        add_func(creator)
+
+    while funcs:
+        f = heapq.heappop(funcs)[2]
+        if f.edges is None:
+            raise RuntimeError(
+                "计算图已经被释放，需要再次反向传播时请在backward中指定retain_graph=True"
+            )
+        for x, creator, k in f.edges:
+            if creator is None or (needed is not None and creator not in needed):
+                continue
+            if stops is None or (creator, k) not in stops:
+                add_func(creator)
+        if plan is not None:
+            steps[f] = len(types)
+            types.append(type(f))
+            targets.append([creator for x, creator, k in f.edges])
+        yield f
+
+    if plan is not None:  # 所有函数的位置都已确定后，把creator换成位置下标
+        plan.types = types
+        plan.targets = [[-1 if c is None else steps[c] for c in t] for t in targets]
+
+
+def _edge(x, keep):
+    """计算图中指向输入变量x的连接(变量, 创建者, 输出序号)
+
+    叶子变量需要写回grad，总是直接引用。中间变量只在keep为True或其创建者需要读取输出时才引用，
+    否则只记录(创建者, 输出序号)，变量本身和它的数据可以在前向传播过程中被回收
+    """
+    creator = x.creator
+    if creator is None:
+        return x, None, None
+    k = _output_index(x)
+    if not keep and "outputs" not in creator.saves:
+        x = None
+    return x, creator, k
+
+
+def _set_tangent(table, x, t):
+    """在切向量表(id(变量) -> (变量的弱引用, 切向量))中记录x的切向量
+
+    表只弱引用变量，变量被回收时它的切向量随之删除，中间结果的切向量不会一直占用内存
+    """
+    key = id(x)
+    table[key] = (weakref.ref(x, lambda _, key=key: table.pop(key, None)), t)
+
+
+def _get_tangent(table, x):
+    """x的切向量，没有时返回None"""
+    entry = table.get(id(x))
+    if entry is None or entry[0]() is not x:
+        return None
+    return entry[1]
+
+
+def _propagate_tangents(f, table, inputs, xs, outputs):
+    """用f.jvp计算输出的切向量并记录在table中，输入都没有切向量时跳过"""
+    txs = [_get_tangent(table, x) for x in inputs]
+    if all(t is None for t in txs):
+        return
+    tys = f.jvp(xs, [y.data for y in outputs], txs)
+    for y, ty in zip(outputs, tys):
+        if ty is not None:
+            _set_tangent(table, y, ty)
+
+
+def _tangent(y, *terms):
+    """逐元素运算输出的切向量：不为None的各项之和广播到输出y的形状，全部为None时返回None"""
+    t = None
+    for term in terms:
+        if term is not None:
+            t = term if t is None else t + term
+    if t is not None and np.shape(t) != y.shape:
+        t = np.broadcast_to(t, y.shape)
+    return t
+
+
+def _align_series(xs):
+    """把几个输入的泰勒系数(第0维是阶数)补齐到相同的维数，使它们可以按numpy的规则广播"""
+    ndim = max([x.ndim for x in xs]) - 1
+    return [dezero.utils.align_batched(x, True, ndim) for x in xs]
+
+
+class BackwardPlan:
+    """静态计算图的反向传播执行计划
+
+    训练循环每次迭代都会重新构建结构相同的计算图。第一次反向传播时记录函数的处理顺序，
+    之后直接沿着记录的连接关系取出新计算图中的函数，不再需要seen_set和优先队列
+
+    types: 按处理顺序排列的函数类型
+    targets: targets[k][i]表示第k个函数的第i个输入由第几个函数创建，叶子变量为-1
+    """
+
+    def __init__(self):
+        self.types = None
+        self.targets = None
+
+    def __len__(self):
+        return 0 if self.types is None else len(self.types)
+
+    def resolve(self, creator):
+        """按照计划取出以creator为终点的计算图中的函数，结构与计划不一致时返回None"""
+        if self.targets is None or creator is None:
+            return None
+        funcs = [None] * len(self.types)
+        funcs[0] = creator
+        for f, targets in zip(funcs, self.targets):
+            if f is None or f.edges is None or len(f.edges) != len(targets):
+                return None
+            for (x, c, k), t in zip(f.edges, targets):
+                if t < 0:
+                    if c is not None:
+                        return None
+                elif funcs[t] is None:
+                    funcs[t] = c  # 第一次遇到，按计划绑定
+                elif funcs[t] is not c:
+                    return None
+        if [type(f) for f in funcs] != self.types or len(set(funcs)) != len(funcs):
+            return None
+        return funcs
+
+
 class Function:
+    # 反向传播需要保留的数据，子类根据backward的需要覆盖：
+    # "inputs"表示保留输入变量，"outputs"表示保留输出变量；
+    # 空元组表示只需要形状（由forward自行记录）或者什么都不需要，此时输入变量不会被引用，可以尽早回收
+    saves = ("inputs",)
+
+    # 每个运算至少创建一个Function和一个Variable，使用__slots__去掉实例的__dict__，
+    # 子类也需要声明__slots__(列出forward中记录的属性)，否则会重新带上__dict__
+    __slots__ = ("inputs", "outputs", "edges", "generation", "__weakref__")
+
+    # 逐元素运算对应的numpy ufunc，不为None时可以被dezero.passes融合，见forward_into
+    ufunc = None
+    # forward的结果是否可能是输入的视图(比如reshape)，dezero.passes规划内存时不会复用这种输入的缓冲区
+    views = False
+
     def __call__(self, *inputs):
-        inputs = [as_variable(x) for x in inputs]
+        config = _config.get()  # 只查找一次当前上下文的配置
+        if config.inference:
+            return self._infer(inputs)
+
+        inputs = [x if isinstance(x, Variable) else Constant(x) for x in inputs]
         # 正向传播的计算
         xs = [x.data for x in inputs]  # 提取Variable的实例变量data并汇总到列表xs中
-        ys = self.forward(*xs)  # 实际执行forward方法进行前向计算
+        ys = None
+        if config.elementwise_threshold is not None and self.ufunc is not None:
+            ys = dezero.parallel.elementwise(self, xs, config)  # 不满足分块条件时返回None
+        if ys is None:
+            ys = self.forward(*xs)  # 实际执行forward方法进行前向计算
         if not isinstance(ys, tuple):
             ys = (ys,)
         outputs = [Variable(as_array(y)) for y in ys]
 
-        if Config.enable_backprop:
+        if config.tape is not None:  # 磁带模式：把这次运算记录为整数数组中的一行
+            config.tape.record(self, inputs, outputs)
+
+        if config.tangents is not None:  # 前向模式：同时传播切向量
+            _propagate_tangents(self, config.tangents, inputs, xs, outputs)
+
+        if config.enable_backprop:
             self.generation = max(
                 [x.generation for x in inputs]
             )  # 获取当前最大的层级树保证能够完成反向传播图中按照正确的顺序进行反向传播
             # 创建连接
             for output in outputs:
                 output.set_creator(self)  # 输出变量保存创造者信息
-            self.inputs = inputs  # 保存输入的变量
-            self.outputs = [
-                weakref.ref(output) for output in outputs
-            ]  # 保存输入的变量，通过弱引用来解除循环引用
+            save_inputs = "inputs" in self.saves
+            self.inputs = tuple(inputs) if save_inputs else None  # 按需保存输入的变量
+            self.edges = tuple([_edge(x, save_inputs) for x in inputs])
+            self.outputs = tuple(
+                [weakref.ref(output) for output in outputs]
+            )  # 保存输入的变量，通过弱引用来解除循环引用
 
         return outputs if len(outputs) > 1 else outputs[0]
 
+    def _infer(self, inputs):
+        """推理模式下的前向传播：不创建连接、不记录磁带，常见的一元和二元运算不构建中间列表"""
+        config = _config.get()
+        if config.elementwise_threshold is not None and self.ufunc is not None:
+            y = dezero.parallel.elementwise(self, [as_variable(x).data for x in inputs], config)
+            if y is not None:
+                return Variable(y)
+        n = len(inputs)
+        if n == 1:
+            x = inputs[0]
+            ys = self.forward(x.data if isinstance(x, Variable) else x)
+        elif n == 2:
+            x0, x1 = inputs
+            ys = self.forward(
+                x0.data if isinstance(x0, Variable) else x0,
+                x1.data if isinstance(x1, Variable) else x1,
+            )
+        else:
+            ys = self.forward(*[as_variable(x).data for x in inputs])
+        if isinstance(ys, tuple):
+            return [Variable(as_array(y)) for y in ys]
+        return Variable(ys if type(ys) is np.ndarray else as_array(ys))
+
+    def setup(self, *xs):
+        """根据完整的输入记录backward需要的信息(比如形状)
+
+        forward会调用它。分块执行时forward只能看到一部分输入，所以结束后会用完整的输入再调用一次
+        """
+        pass
+
     def forward(self, xs):
         raise NotImplementedError()
 
     def backward(self, xs):
         raise NotImplementedError()
 
+    def forward_into(self, out, *xs):
+        """逐元素运算的前向传播，把结果写入预先分配的out并返回out"""
+        return self.ufunc(*xs, out=out)
+
+    def forward_source(self, xs):
+        """返回计算前向传播结果的Python表达式(只使用numpy)，供dezero.codegen生成代码
+
+        xs: 输入的变量名
+        """
+        raise NotImplementedError()
+
+    def vjp_source(self, xs, ys, gys):
+        """返回计算各个输入梯度的Python表达式组成的元组，与vjp对应
+
+        xs, ys, gys: 输入、输出和输出梯度的变量名
+        """
+        raise NotImplementedError()
+
+    def jvp(self, xs, ys, txs):
+        """前向模式自动微分：在ndarray层面根据输入的切向量计算输出的切向量
+
+        xs, ys: 前向传播的输入和输出(ndarray)
+        txs: 输入的切向量(ndarray，None表示0)
+        返回输出的切向量(ndarray或None)组成的元组
+        """
+        raise NotImplementedError("jvp: {} does not implement jvp".format(type(self).__name__))
+
+    def forward_batched(self, xs, batched):
+        """dezero.vmap使用的批量前向传播，至少有一个输入是批量的时候才会调用
+
+        xs: 输入(ndarray)，批量的输入多出第0维作为批量维
+        batched: 每个输入是否是批量的
+        返回批量的输出。默认实现适用于逐元素运算(ufunc不为None)，其他运算需要覆盖
+        """
+        if self.ufunc is None:
+            raise NotImplementedError(
+                "vmap: {} does not implement forward_batched".format(type(self).__name__)
+            )
+        ndim = max([x.ndim - b for x, b in zip(xs, batched)])
+        args = [dezero.utils.align_batched(x, b, ndim) for x, b in zip(xs, batched)]
+        return self.forward_into(None, *args)
+
+    def vjp_batched(self, xs, batched, ys, gys, needs=None):
+        """dezero.vmap使用的批量反向传播，返回每个样本各自的梯度
+
+        xs, batched: 同forward_batched，ys: 批量的输出，gys: 批量的输出梯度
+        needs: 每个输入是否需要梯度，不需要的可以返回None；为None时全部需要
+        返回输入的梯度组成的元组，不论输入是否是批量的，梯度都带有批量维。
+        默认实现用jvp求出逐元素运算对每个输入的偏导数，与gy相乘后对每个样本求和到输入的形状
+        """
+        if self.ufunc is None:
+            raise NotImplementedError(
+                "vmap: {} does not implement vjp_batched".format(type(self).__name__)
+            )
+        ndim = max([x.ndim - b for x, b in zip(xs, batched)])
+        args = [dezero.utils.align_batched(x, b, ndim) for x, b in zip(xs, batched)]
+        one = np.ones((), dtype=ys[0].dtype)
+        gxs = []
+        for i, (x, b) in enumerate(zip(xs, batched)):
+            if needs is not None and not needs[i]:
+                gxs.append(None)
+                continue
+            txs = [None] * len(xs)
+            txs[i] = one
+            d = self.jvp(args, ys, txs)[0]
+            gxs.append(dezero.utils.sum_to_batched(gys[0] * d, x.shape[1:] if b else x.shape))
+        return tuple(gxs)
+
+    def jvp_batched(self, xs, ys, txs):
+        """dezero.jacobian前向模式使用的jvp：同时传播一批切向量
+
+        xs, ys: 前向传播的输入和输出(ndarray，没有批量维)
+        txs: 输入的一批切向量(第0维是批量维，None表示0)
+        返回输出的一批切向量组成的元组。默认实现适用于逐元素运算：用jvp求出对每个输入的偏导数后与切向量相乘
+        """
+        if self.ufunc is None:
+            raise NotImplementedError(
+                "jacobian: {} does not implement jvp_batched".format(type(self).__name__)
+            )
+        one = np.ones((), dtype=ys[0].dtype)
+        ty = None
+        for i, tx in enumerate(txs):
+            if tx is None:
+                continue
+            seeds = [None] * len(xs)
+            seeds[i] = one
+            d = self.jvp(xs, ys, seeds)[0]
+            term = dezero.utils.align_batched(tx, True, ys[0].ndim) * d
+            ty = term if ty is None else ty + term
+        return (ty,)
+
+    def taylor(self, xs):
+        """泰勒模式：传播截断幂级数，供dezero.taylor使用
+
+        xs: 输入的泰勒系数(ndarray)，第0维是系数的阶数，xs[i][0]就是输入的值
+        返回输出的泰勒系数组成的元组，阶数与输入相同
+        """
+        raise NotImplementedError("taylor: {} does not implement taylor".format(type(self).__name__))
+
+    def vjp(self, xs, ys, gys):
+        """在ndarray层面进行反向传播，不创建Variable和Function，供磁带和dezero.jit回放使用
+
+        xs, ys: 前向传播的输入和输出(ndarray，不需要的数据可以为None)
+        gys: 输出的梯度(ndarray或None)
+        返回输入的梯度(ndarray或None)组成的元组。默认实现把输入输出绑定到一个浅拷贝上调用backward，
+        常用的运算覆盖这个方法直接用numpy计算。dezero.jit的所有调用共用Program中的Function，
+        多个线程可能同时对同一个实例调用vjp，所以不能修改self
+        """
+        f = copy.copy(self)
+        outputs = [Variable(y) for y in ys]
+        f.inputs = tuple([Variable(x) for x in xs])
+        f.outputs = tuple([weakref.ref(o) for o in outputs])
+        with using_config("enable_backprop", False), using_config("tape", None):
+            gxs = f.backward(*[None if g is None else Variable(g) for g in gys])
+        if not isinstance(gxs, tuple):
+            gxs = (gxs,)
+        return tuple([None if gx is None else as_variable(gx).data for gx in gxs])
+
 
 class Add(Function):
-    def forward(self, x0, x1):
+    __slots__ = ("x0_shape", "x1_shape")
+    saves = ()
+    ufunc = np.add
+
+    def setup(self, x0, x1):
         self.x0_shape, self.x1_shape = x0.shape, x1.shape
+
+    def forward(self, x0, x1):
+        self.setup(x0, x1)
         y = x0 + x1
         return y
 
@@ -177,8 +681,39 @@ class Add(Function):
             gx1 = dezero.functions.sum_to(gx1, self.x1_shape)
         return gx0, gx1
 
+    def jvp(self, xs, ys, txs):
+        return (_tangent(ys[0], *txs),)
+
+    def taylor(self, xs):
+        x0, x1 = _align_series(xs)
+        return (x0 + x1,)
+
+    def vjp(self, xs, ys, gys):
+        gy = gys[0]
+        if self.x0_shape != self.x1_shape:
+            return (
+                dezero.utils.sum_to(gy, self.x0_shape),
+                dezero.utils.sum_to(gy, self.x1_shape),
+            )
+        return gy, gy
+
+    def forward_source(self, xs):
+        return "{} + {}".format(*xs)
+
+    def vjp_source(self, xs, ys, gys):
+        gy = gys[0]
+        if self.x0_shape != self.x1_shape:
+            return (
+                "sum_to({}, {!r})".format(gy, self.x0_shape),
+                "sum_to({}, {!r})".format(gy, self.x1_shape),
+            )
+        return gy, gy
+
 
 class Mul(Function):
+    __slots__ = ()
+    ufunc = np.multiply
+
     def forward(self, x0, x1):
         y = x0 * x1
         return y
@@ -187,22 +722,73 @@ class Mul(Function):
         # x0, x1 = self.inputs[0].data, self.inputs[1].data  # 之前的实现时从Variable中取出数据（ndarray实例）
         x0, x1 = self.inputs
         return (
-            gy * x1,
-            gy * x0,
-        )  # 因为现在x1、x0和gy都是Variable，所以会调用mul继续创建计算图
+            None if type(x0) is Constant else gy * x1,
+            None if type(x1) is Constant else gy * x0,
+        )  # 因为现在x1、x0和gy都是Variable，所以会调用mul继续创建计算图；常量不需要梯度
+
+    def jvp(self, xs, ys, txs):
+        x0, x1 = xs
+        tx0, tx1 = txs
+        return (
+            _tangent(
+                ys[0],
+                None if tx0 is None else tx0 * x1,
+                None if tx1 is None else x0 * tx1,
+            ),
+        )
+
+    def taylor(self, xs):
+        return (dezero.utils.cauchy_product(*_align_series(xs)),)
+
+    def vjp(self, xs, ys, gys):
+        x0, x1 = xs
+        return gys[0] * x1, gys[0] * x0
+
+    def forward_source(self, xs):
+        return "{} * {}".format(*xs)
+
+    def vjp_source(self, xs, ys, gys):
+        x0, x1 = xs
+        return "{} * {}".format(gys[0], x1), "{} * {}".format(gys[0], x0)
 
 
 class Neg(Function):
+    __slots__ = ()
+    saves = ()
+    ufunc = np.negative
+
     def forward(self, x):
         return -x
 
     def backward(self, gy):
         return -gy
 
+    def jvp(self, xs, ys, txs):
+        return (-txs[0],)
+
+    def taylor(self, xs):
+        return (-xs[0],)
+
+    def vjp(self, xs, ys, gys):
+        return (-gys[0],)
+
+    def forward_source(self, xs):
+        return "-{}".format(xs[0])
+
+    def vjp_source(self, xs, ys, gys):
+        return ("-{}".format(gys[0]),)
+
 
 class Sub(Function):
-    def forward(self, x0, x1):
+    __slots__ = ("x0_shape", "x1_shape")
+    saves = ()
+    ufunc = np.subtract
+
+    def setup(self, x0, x1):
         self.x0_shape, self.x1_shape = x0.shape, x1.shape
+
+    def forward(self, x0, x1):
+        self.setup(x0, x1)
         return x0 - x1
 
     def backward(self, gy):
@@ -212,8 +798,40 @@ class Sub(Function):
             gx1 = dezero.functions.sum_to(gx1, self.x1_shape)
         return gx0, -gx1
 
+    def jvp(self, xs, ys, txs):
+        tx0, tx1 = txs
+        return (_tangent(ys[0], tx0, None if tx1 is None else -tx1),)
+
+    def taylor(self, xs):
+        x0, x1 = _align_series(xs)
+        return (x0 - x1,)
+
+    def vjp(self, xs, ys, gys):
+        gy = gys[0]
+        if self.x0_shape != self.x1_shape:
+            return (
+                dezero.utils.sum_to(gy, self.x0_shape),
+                -dezero.utils.sum_to(gy, self.x1_shape),
+            )
+        return gy, -gy
+
+    def forward_source(self, xs):
+        return "{} - {}".format(*xs)
+
+    def vjp_source(self, xs, ys, gys):
+        gy = gys[0]
+        if self.x0_shape != self.x1_shape:
+            return (
+                "sum_to({}, {!r})".format(gy, self.x0_shape),
+                "-sum_to({}, {!r})".format(gy, self.x1_shape),
+            )
+        return gy, "-{}".format(gy)
+
 
 class Div(Function):
+    __slots__ = ()
+    ufunc = np.divide
+
     def forward(self, x0, x1):
         y = x0 / x1
         return y
@@ -221,12 +839,48 @@ class Div(Function):
     def backward(self, gy):
         # x0, x1 = self.inputs[0].data, self.inputs[1].data
         x0, x1 = self.inputs
-        gx0 = gy / 1
-        gx1 = gy * (-x0 / x1**2)
+        gx0 = None if type(x0) is Constant else gy / x1
+        gx1 = None if type(x1) is Constant else gy * (-x0 / x1**2)
         return gx0, gx1
 
+    def jvp(self, xs, ys, txs):
+        x0, x1 = xs
+        tx0, tx1 = txs
+        return (
+            _tangent(
+                ys[0],
+                None if tx0 is None else tx0 / x1,
+                None if tx1 is None else tx1 * (-x0 / x1**2),
+            ),
+        )
+
+    def taylor(self, xs):
+        # q = x0 / x1，由x0 = q * x1逐阶解出q
+        x0, x1 = _align_series(xs)
+        q = np.empty(np.broadcast_shapes(x0.shape, x1.shape), np.result_type(x0, x1, 1.0))
+        q[0] = x0[0] / x1[0]
+        for j in range(1, len(q)):
+            q[j] = (x0[j] - (x1[1 : j + 1] * q[j - 1 :: -1]).sum(axis=0)) / x1[0]
+        return (q,)
+
+    def vjp(self, xs, ys, gys):
+        x0, x1 = xs
+        gy = gys[0]
+        return gy / x1, gy * (-x0 / x1**2)
+
+    def forward_source(self, xs):
+        return "{} / {}".format(*xs)
+
+    def vjp_source(self, xs, ys, gys):
+        x0, x1 = xs
+        gy = gys[0]
+        return "{} / {}".format(gy, x1), "{} * (-{} / {} ** 2)".format(gy, x0, x1)
+
 
 class Pow(Function):
+    __slots__ = ("c",)
+    ufunc = np.power
+
     def __init__(self, c):
         self.c = c
 
@@ -234,6 +888,11 @@ class Pow(Function):
         y = x**self.c
         return y
 
+    def forward_into(self, out, x):
+        if self.c == 2:  # 与x**2相同，使用更快的平方
+            return np.square(x, out=out)
+        return np.power(x, self.c, out=out)
+
     def backward(self, gy):
         # x = self.inputs[0].data
         x = self.inputs[0]
@@ -241,43 +900,159 @@ class Pow(Function):
         gx = c * x ** (c - 1) * gy
         return gx
 
+    def jvp(self, xs, ys, txs):
+        c = self.c
+        return (c * xs[0] ** (c - 1) * txs[0],)
+
+    def taylor(self, xs):
+        x, c = xs[0], self.c
+        if float(c).is_integer() and c >= 0:  # 非负整数次幂用级数乘法计算，x为0时也成立
+            y = np.zeros(x.shape, np.result_type(x, 1.0))
+            y[0] = 1
+            base, n = x, int(c)
+            while n:
+                if n & 1:
+                    y = dezero.utils.cauchy_product(y, base)
+                n >>= 1
+                if n:
+                    base = dezero.utils.cauchy_product(base, base)
+            return (y,)
+        # y = x**c满足x * y' = c * x' * y，由此逐阶解出y(要求x的值不为0)
+        y = np.empty(x.shape, np.result_type(x, 1.0))
+        y[0] = x[0] ** c
+        for j in range(1, len(y)):
+            i = np.arange(1, j + 1).reshape((j,) + (1,) * (x.ndim - 1))
+            y[j] = ((c * i - (j - i)) * x[1 : j + 1] * y[j - 1 :: -1]).sum(axis=0) / (j * x[0])
+        return (y,)
+
+    def vjp(self, xs, ys, gys):
+        c = self.c
+        return (c * xs[0] ** (c - 1) * gys[0],)
+
+    def forward_source(self, xs):
+        return "{} ** {!r}".format(xs[0], self.c)
+
+    def vjp_source(self, xs, ys, gys):
+        c = self.c
+        return ("{!r} * {} ** {!r} * {}".format(c, xs[0], c - 1, gys[0]),)
+
+
+def _constant(x):
+    """x是常量(不是Variable的数值或者Constant)时返回它的数据，否则返回None"""
+    if isinstance(x, Variable):
+        return x.data if type(x) is Constant else None
+    return x
+
+
+def _filled(c, value, x):
+    """常量c的每个元素都等于value，并且ufunc(x, c)的形状和dtype都与x相同，结果可以直接用x代替
+
+    x必须是某个函数的输出：用户的叶子变量可能成为其他变量的grad，直接返回它会混淆两者
+    """
+    if c is None or x.creator is None or c.ndim > x.ndim:
+        return False
+    if c.size == 1:  # 常见的情况是标量，不需要检查广播
+        if c.item() != value:
+            return False
+    elif np.broadcast_shapes(c.shape, x.shape) != x.shape or not np.all(c == value):
+        return False
+    return np.result_type(x.data, c) == x.dtype
+
+
+def _simplify(ufunc, x0, x1, c0, c1):
+    """化简二元运算ufunc(x0, x1)，c0、c1为_constant(x0)、_constant(x1)，不能化简时返回None
+
+    两边都是常量时直接计算出Constant；x + 0、0 + x、x - 0、x * 1、1 * x、x / 1返回x本身，0 - x变为-x。
+    x * 0不化简，x中的inf和nan乘以0结果为nan
+    """
+    if c0 is None and c1 is None:
+        return None
+    if c0 is not None and c1 is not None:
+        return Constant(as_array(ufunc(c0, c1)))
+    if ufunc is np.add or ufunc is np.multiply:
+        unit = 0 if ufunc is np.add else 1
+        if _filled(c0, unit, x1):
+            return x1
+    if _filled(c1, 1 if ufunc in (np.multiply, np.divide) else 0, x0):
+        return x0
+    if ufunc is np.subtract and _filled(c0, 0, x1):
+        return neg(x1)
+    return None
+
+
+def _constant_key(c):
+    """公共子表达式的键中代表常量c的部分：按值比较，每次都会重新包装的1、-1等可以共用"""
+    return c.dtype.str, c.shape, c.tobytes()
+
+
+def _apply(subexpressions, key, f, *xs):
+    """本次反向传播中已经用同样的输入执行过同样的运算时直接返回之前的输出，否则执行f(*xs)"""
+    y = subexpressions.get(key)
+    if y is None:
+        y = subexpressions[key] = f(*xs)
+    return y
+
+
+def _binary(cls, ufunc, x0, x1):
+    subexpressions = _config.get().subexpressions
+    if subexpressions is None:
+        return cls()(x0, x1)
+    c0, c1 = _constant(x0), _constant(x1)
+    y = _simplify(ufunc, x0, x1, c0, c1)
+    if y is None:
+        key = (
+            ufunc,
+            x0 if c0 is None else _constant_key(c0),
+            x1 if c1 is None else _constant_key(c1),
+        )
+        y = _apply(subexpressions, key, cls(), x0, x1)
+    return y
+
 
 def pow(x, c):
-    return Pow(c)(x)
+    subexpressions = _config.get().subexpressions
+    if subexpressions is None:
+        return Pow(c)(x)
+    if type(x) is Constant:
+        return Constant(as_array(x.data**c))
+    if not np.isscalar(c):
+        return Pow(c)(x)
+    if c == 1 and x.creator is not None:
+        return x
+    return _apply(subexpressions, (np.power, x, c), Pow(c), x)
 
 
 def div(x0, x1):
-    x1 = as_array(x1)
-    return Div()(x0, x1)
+    return _binary(Div, np.divide, x0, as_array(x1))
 
 
 def rdiv(x0, x1):
-    x1 = as_array(x1)
-    return Div()(x1, x0)
+    return _binary(Div, np.divide, as_array(x1), x0)
 
 
 def sub(x0, x1):
-    x1 = as_array(x1)
-    return Sub()(x0, x1)
+    return _binary(Sub, np.subtract, x0, as_array(x1))
 
 
 def rsub(x0, x1):
-    x1 = as_array(x1)
-    return Sub()(x1, x0)
+    return _binary(Sub, np.subtract, as_array(x1), x0)
 
 
 def neg(x):
-    return Neg()(x)
+    subexpressions = _config.get().subexpressions
+    if subexpressions is None:
+        return Neg()(x)
+    if type(x) is Constant:
+        return Constant(as_array(-x.data))
+    return _apply(subexpressions, (np.negative, x), Neg(), x)
 
 
 def add(x0, x1):
-    x1 = as_array(x1)
-    return Add()(x0, x1)
+    return _binary(Add, np.add, x0, as_array(x1))
 
 
 def mul(x0, x1):
-    x1 = as_array(x1)
-    return Mul()(x0, x1)
+    return _binary(Mul, np.multiply, x0, as_array(x1))
 
 
 def setup_variable():
@@ -299,18 +1074,21 @@ def as_array(x):
     return x
 
 
-import contextlib
-
-
 @contextlib.contextmanager
 def using_config(name, value):
-    old_value = getattr(Config, name)
-    setattr(Config, name, value)
+    token = _config.set(_config.get().replace(name, value))
     try:
         yield
     finally:
-        setattr(Config, name, old_value)
+        _config.reset(token)
 
 
 def no_grad():
     return using_config("enable_backprop", False)
+
+
+@contextlib.contextmanager
+def inference_mode():
+    """推理模式：只需要前向计算的结果时使用，跳过no_grad下仍然存在的所有计算图相关处理"""
+    with using_config("enable_backprop", False), using_config("inference", True):
+        yield
@@ -1,11 +1,17 @@
 import numpy as np
 
-from dezero import Function
+from dezero import Function, Variable
 from dezero import as_variable, as_array
+from dezero import using_config
+from dezero.core import Config
 from dezero import utils
+from dezero.core import _backprop, _tangent, _get_tangent, _set_tangent
 
 
 class Sin(Function):
+    __slots__ = ()
+    ufunc = np.sin
+
     def forward(self, x):
         y = np.sin(x)
         return y
@@ -16,8 +22,26 @@ class Sin(Function):
         gx = gy * cos(x)
         return gx
 
+    def jvp(self, xs, ys, txs):
+        return (np.cos(xs[0]) * txs[0],)
+
+    def taylor(self, xs):
+        return (_sin_cos_series(xs[0])[0],)
+
+    def vjp(self, xs, ys, gys):
+        return (gys[0] * np.cos(xs[0]),)
+
+    def forward_source(self, xs):
+        return "np.sin({})".format(xs[0])
+
+    def vjp_source(self, xs, ys, gys):
+        return ("{} * np.cos({})".format(gys[0], xs[0]),)
+
 
 class Cos(Function):
+    __slots__ = ()
+    ufunc = np.cos
+
     def forward(self, x):
         y = np.cos(x)
         return y
@@ -28,8 +52,27 @@ class Cos(Function):
         gx = gy * -sin(x)
         return gx
 
+    def jvp(self, xs, ys, txs):
+        return (-np.sin(xs[0]) * txs[0],)
+
+    def taylor(self, xs):
+        return (_sin_cos_series(xs[0])[1],)
+
+    def vjp(self, xs, ys, gys):
+        return (gys[0] * -np.sin(xs[0]),)
+
+    def forward_source(self, xs):
+        return "np.cos({})".format(xs[0])
+
+    def vjp_source(self, xs, ys, gys):
+        return ("{} * -np.sin({})".format(gys[0], xs[0]),)
+
 
 class Tanh(Function):
+    __slots__ = ()
+    saves = ("outputs",)
+    ufunc = np.tanh
+
     def forward(self, x):
         y = np.tanh(x)
         return y
@@ -39,8 +82,40 @@ class Tanh(Function):
         gx = gy * (1 - y * y)
         return gx
 
+    def jvp(self, xs, ys, txs):
+        y = ys[0]
+        return ((1 - y * y) * txs[0],)
+
+    def taylor(self, xs):
+        # y' = z * x'，z = 1 - y**2
+        x = xs[0]
+        y = np.empty(x.shape, np.result_type(x, 1.0))
+        z = np.empty_like(y)
+        y[0] = np.tanh(x[0])
+        z[0] = 1 - y[0] * y[0]
+        for j in range(1, len(x)):
+            i = np.arange(1, j + 1).reshape((j,) + (1,) * (x.ndim - 1))
+            y[j] = (i * x[1 : j + 1] * z[j - 1 :: -1]).sum(axis=0) / j
+            z[j] = -(y[: j + 1] * y[j::-1]).sum(axis=0)
+        return (y,)
+
+    def vjp(self, xs, ys, gys):
+        y = ys[0]
+        return (gys[0] * (1 - y * y),)
+
+    def forward_source(self, xs):
+        return "np.tanh({})".format(xs[0])
+
+    def vjp_source(self, xs, ys, gys):
+        y = ys[0]
+        return ("{} * (1 - {} * {})".format(gys[0], y, y),)
+
 
 class Reshape(Function):
+    __slots__ = ("shape", "x_shape")
+    saves = ()
+    views = True
+
     def __init__(self, shape) -> None:
         self.shape = shape
 
@@ -52,8 +127,38 @@ class Reshape(Function):
     def backward(self, gy):
         return reshape(gy, self.x_shape)
 
+    def jvp(self, xs, ys, txs):
+        return (np.reshape(txs[0], self.shape),)
+
+    def forward_batched(self, xs, batched):
+        x = xs[0]
+        return x.reshape(x.shape[:1] + tuple(self.shape))
+
+    def vjp_batched(self, xs, batched, ys, gys, needs=None):
+        gy = gys[0]
+        return (gy.reshape(gy.shape[:1] + self.x_shape),)
+
+    def jvp_batched(self, xs, ys, txs):
+        return (self.forward_batched(txs, [True]),)
+
+    def taylor(self, xs):
+        return (self.forward_batched(xs, [True]),)
+
+    def vjp(self, xs, ys, gys):
+        return (gys[0].reshape(self.x_shape),)
+
+    def forward_source(self, xs):
+        return "{}.reshape({!r})".format(xs[0], self.shape)
+
+    def vjp_source(self, xs, ys, gys):
+        return ("{}.reshape({!r})".format(gys[0], self.x_shape),)
+
 
 class Transpose(Function):
+    __slots__ = ()
+    saves = ()
+    views = True
+
     def forward(self, x):
         y = np.transpose(x)
         return y
@@ -62,8 +167,35 @@ class Transpose(Function):
         gx = transpose(gy)
         return gx
 
+    def jvp(self, xs, ys, txs):
+        return (np.transpose(txs[0]),)
+
+    def forward_batched(self, xs, batched):
+        return _transpose_batched(xs[0])
+
+    def vjp_batched(self, xs, batched, ys, gys, needs=None):
+        return (_transpose_batched(gys[0]),)
+
+    def jvp_batched(self, xs, ys, txs):
+        return (self.forward_batched(txs, [True]),)
+
+    def taylor(self, xs):
+        return (self.forward_batched(xs, [True]),)
+
+    def vjp(self, xs, ys, gys):
+        return (np.transpose(gys[0]),)
+
+    def forward_source(self, xs):
+        return "np.transpose({})".format(xs[0])
+
+    def vjp_source(self, xs, ys, gys):
+        return ("np.transpose({})".format(gys[0]),)
+
 
 class Sum(Function):
+    __slots__ = ("axis", "keepdims", "x_shape")
+    saves = ()
+
     def __init__(self, axis, keepdims):
         self.axis = axis
         self.keepdims = keepdims
@@ -75,11 +207,53 @@ class Sum(Function):
 
     def backward(self, gy):
         gy = utils.reshape_sum_backward(gy, self.x_shape, self.axis, self.keepdims)
-        gx = np.broadcast_to(gy, self.x_shape, self)
+        gx = broadcast_to(gy, self.x_shape)
         return gx
 
+    def jvp(self, xs, ys, txs):
+        return (np.sum(txs[0], axis=self.axis, keepdims=self.keepdims),)
+
+    def forward_batched(self, xs, batched):
+        x = xs[0]
+        if self.axis is None:
+            axis = tuple(range(1, x.ndim))
+        else:
+            axis = self.axis if isinstance(self.axis, tuple) else (self.axis,)
+            axis = tuple([a % (x.ndim - 1) + 1 for a in axis])
+        return x.sum(axis=axis, keepdims=self.keepdims)
+
+    def vjp_batched(self, xs, batched, ys, gys, needs=None):
+        # 每个样本的梯度需要变成的形状，用不占内存的广播视图求出
+        sample = np.broadcast_to(np.zeros((), gys[0].dtype), gys[0].shape[1:])
+        shape = utils.reshape_sum_backward(sample, self.x_shape, self.axis, self.keepdims).shape
+        gy = utils.align_batched(gys[0].reshape(gys[0].shape[:1] + shape), True, len(self.x_shape))
+        return (np.broadcast_to(gy, gy.shape[:1] + self.x_shape),)
+
+    def jvp_batched(self, xs, ys, txs):
+        return (self.forward_batched(txs, [True]),)
+
+    def taylor(self, xs):
+        return (self.forward_batched(xs, [True]),)
+
+    def vjp(self, xs, ys, gys):
+        gy = utils.reshape_sum_backward(gys[0], self.x_shape, self.axis, self.keepdims)
+        return (np.broadcast_to(gy, self.x_shape),)
+
+    def forward_source(self, xs):
+        return "{}.sum(axis={!r}, keepdims={!r})".format(xs[0], self.axis, self.keepdims)
+
+    def vjp_source(self, xs, ys, gys):
+        gy = "reshape_sum_backward({}, {!r}, {!r}, {!r})".format(
+            gys[0], self.x_shape, self.axis, self.keepdims
+        )
+        return ("np.broadcast_to({}, {!r})".format(gy, self.x_shape),)
+
 
 class BroadcastTo(Function):
+    __slots__ = ("shape", "x_shape")
+    saves = ()
+    views = True
+
     def __init__(self, shape):
         self.shape = shape
 
@@ -92,8 +266,36 @@ class BroadcastTo(Function):
         gx = sum_to(gy, self.x_shape)
         return gx
 
+    def jvp(self, xs, ys, txs):
+        return (np.broadcast_to(txs[0], self.shape),)
+
+    def forward_batched(self, xs, batched):
+        x = utils.align_batched(xs[0], True, len(self.shape))
+        return np.broadcast_to(x, x.shape[:1] + tuple(self.shape))
+
+    def vjp_batched(self, xs, batched, ys, gys, needs=None):
+        return (utils.sum_to_batched(gys[0], self.x_shape),)
+
+    def jvp_batched(self, xs, ys, txs):
+        return (self.forward_batched(txs, [True]),)
+
+    def taylor(self, xs):
+        return (self.forward_batched(xs, [True]),)
+
+    def vjp(self, xs, ys, gys):
+        return (utils.sum_to(gys[0], self.x_shape),)
+
+    def forward_source(self, xs):
+        return "np.broadcast_to({}, {!r})".format(xs[0], self.shape)
+
+    def vjp_source(self, xs, ys, gys):
+        return ("sum_to({}, {!r})".format(gys[0], self.x_shape),)
+
 
 class SumTo(Function):
+    __slots__ = ("shape", "x_shape")
+    saves = ()
+
     def __init__(self, shape):
         self.shape = shape
 
@@ -106,18 +308,199 @@ class SumTo(Function):
         gx = broadcast_to(gy, self.x_shape)
         return gx
 
+    def jvp(self, xs, ys, txs):
+        return (utils.sum_to(txs[0], self.shape),)
+
+    def forward_batched(self, xs, batched):
+        return utils.sum_to_batched(xs[0], self.shape)
+
+    def vjp_batched(self, xs, batched, ys, gys, needs=None):
+        gy = utils.align_batched(gys[0], True, len(self.x_shape))
+        return (np.broadcast_to(gy, gy.shape[:1] + self.x_shape),)
+
+    def jvp_batched(self, xs, ys, txs):
+        return (self.forward_batched(txs, [True]),)
+
+    def taylor(self, xs):
+        return (self.forward_batched(xs, [True]),)
+
+    def vjp(self, xs, ys, gys):
+        return (np.broadcast_to(gys[0], self.x_shape),)
+
+    def forward_source(self, xs):
+        return "sum_to({}, {!r})".format(xs[0], self.shape)
+
+    def vjp_source(self, xs, ys, gys):
+        return ("np.broadcast_to({}, {!r})".format(gys[0], self.x_shape),)
+
 
 class MatMul(Function):
+    __slots__ = ()
     def forward(self, x, W):
         y = x.dot(W)
         return y
 
+    def forward_into(self, out, x, W):
+        return np.dot(x, W, out=out)
+
     def backward(self, gy):
         x, W = self.inputs
         gx = matmul(gy, W.T)
         gW = matmul(x.T, gy)
         return gx, gW
 
+    def jvp(self, xs, ys, txs):
+        x, W = xs
+        tx, tW = txs
+        return (
+            _tangent(
+                ys[0],
+                None if tx is None else np.dot(tx, W),
+                None if tW is None else np.dot(x, tW),
+            ),
+        )
+
+    def forward_batched(self, xs, batched):
+        (x, W), (bx, bW) = xs, batched
+        vx, vW = x.ndim - bx == 1, W.ndim - bW == 1
+        if max(x.ndim - bx, W.ndim - bW) > 2:
+            raise NotImplementedError("vmap: MatMul supports only vectors and matrices")
+        y = np.matmul(_as_row(x) if vx else x, _as_column(W) if vW else W)
+        return _squeeze_matmul(y, vx, vW)
+
+    def vjp_batched(self, xs, batched, ys, gys, needs=None):
+        (x, W), (bx, bW) = xs, batched
+        vx, vW = x.ndim - bx == 1, W.ndim - bW == 1
+        if max(x.ndim - bx, W.ndim - bW) > 2:
+            raise NotImplementedError("vmap: MatMul supports only vectors and matrices")
+        # 向量补成矩阵之后按照矩阵的公式计算，再去掉补上的维度
+        x = _as_row(x) if vx else x
+        W = _as_column(W) if vW else W
+        gy = gys[0]
+        if vW:
+            gy = gy[..., None]
+        if vx:
+            gy = gy[..., None, :]
+        gx = gW = None
+        if needs is None or needs[0]:
+            gx = np.matmul(gy, np.swapaxes(W, -1, -2))
+            gx = gx[..., 0, :] if vx else gx
+        if needs is None or needs[1]:
+            gW = np.matmul(np.swapaxes(x, -1, -2), gy)
+            gW = gW[..., 0] if vW else gW
+        return gx, gW
+
+    def jvp_batched(self, xs, ys, txs):
+        (x, W), (tx, tW) = xs, txs
+        ty = None
+        if tx is not None:
+            ty = self.forward_batched([tx, W], [True, False])
+        if tW is not None:
+            t = self.forward_batched([x, tW], [False, True])
+            ty = t if ty is None else ty + t
+        return (ty,)
+
+    def taylor(self, xs):
+        x, W = xs
+        return (utils.cauchy_product(x, W, lambda a, b: self.forward_batched([a, b], [True, True])),)
+
+    def vjp(self, xs, ys, gys):
+        x, W = xs
+        gy = gys[0]
+        return gy.dot(W.T), x.T.dot(gy)
+
+    def forward_source(self, xs):
+        return "{}.dot({})".format(*xs)
+
+    def vjp_source(self, xs, ys, gys):
+        x, W = xs
+        gy = gys[0]
+        return "{}.dot({}.T)".format(gy, W), "{}.T.dot({})".format(x, gy)
+
+
+class Checkpoint(Function):
+    """梯度检查点：前向传播时不保留fn内部的中间结果，反向传播时重新执行fn来求梯度
+
+    用额外一次前向计算换取内存。只保存fn的输入，fn内部的中间变量不会保留梯度(retain_grad无效)。
+    fn引用的外部变量(比如层的参数)与普通的反向传播一样把梯度累积到grad上
+    """
+
+    __slots__ = ("fn",)
+    views = True  # fn可能直接返回输入
+
+    def __init__(self, fn):
+        self.fn = fn
+
+    def forward(self, *xs):
+        with using_config("enable_backprop", False), using_config("tape", None):
+            ys = self.fn(*[Variable(x) for x in xs])
+        if isinstance(ys, (tuple, list)):
+            return tuple(as_variable(y).data for y in ys)
+        return as_variable(ys).data
+
+    def backward(self, *gys):
+        create_graph = Config.enable_backprop  # 反向传播时由Variable.backward根据create_graph设置
+        with using_config("enable_backprop", True):  # 在原始输入上重新执行fn，创建局部计算图
+            ys = self.fn(*self.inputs)
+        if not isinstance(ys, (tuple, list)):
+            ys = (ys,)
+        roots = [(as_variable(y), gy) for y, gy in zip(ys, gys) if gy is not None]
+        gxs = _backprop(roots, create_graph=create_graph, inputs=self.inputs, leaves=True)
+        return tuple(gxs)
+
+    def jvp(self, xs, ys, txs):
+        inputs = [Variable(x) for x in xs]
+        tangents = dict(Config.tangents or {})  # 在fn内部继续传播切向量，不影响外部的表
+        for x, t in zip(inputs, txs):
+            if t is not None:
+                _set_tangent(tangents, x, t)
+        with using_config("enable_backprop", False), using_config("tape", None), using_config(
+            "tangents", tangents
+        ):
+            outputs = self.fn(*inputs)
+        if not isinstance(outputs, (tuple, list)):
+            outputs = (outputs,)
+        return tuple([_get_tangent(tangents, as_variable(y)) for y in outputs])
+
+
+def _sin_cos_series(x):
+    """sin(x)和cos(x)的泰勒系数：s' = c * x'，c' = -s * x'"""
+    s = np.empty(x.shape, np.result_type(x, 1.0))
+    c = np.empty_like(s)
+    s[0], c[0] = np.sin(x[0]), np.cos(x[0])
+    for j in range(1, len(x)):
+        ix = np.arange(1, j + 1).reshape((j,) + (1,) * (x.ndim - 1)) * x[1 : j + 1]
+        s[j] = (ix * c[j - 1 :: -1]).sum(axis=0) / j
+        c[j] = -(ix * s[j - 1 :: -1]).sum(axis=0) / j
+    return s, c
+
+
+def _transpose_batched(x):
+    """反转每个样本的所有维度，批量维保持在第0维"""
+    return np.transpose(x, (0,) + tuple(range(x.ndim - 1, 0, -1)))
+
+
+def _as_row(x):
+    return x[..., None, :]
+
+
+def _as_column(x):
+    return x[..., :, None]
+
+
+def _squeeze_matmul(y, vx, vW):
+    """去掉_as_row和_as_column补上的维度"""
+    if vW:
+        y = y[..., 0]
+    if vx:
+        y = y[..., 0] if vW else y[..., 0, :]
+    return y
+
+
+def checkpoint(fn, *xs):
+    """以梯度检查点的方式执行fn(*xs)，见Checkpoint"""
+    return Checkpoint(fn)(*xs)
+
 
 def matmul(x, W):
     return MatMul()(x, W)
@@ -0,0 +1,585 @@
+import collections
+import functools
+import hashlib
+import inspect
+import os
+import pickle
+import sys
+import tempfile
+import threading
+import numpy as np
+
+import dezero
+from dezero.core import Variable, Config, as_array, _config
+from dezero import passes
+from dezero.functions import Checkpoint
+from dezero.tape import Tape
+
+
+class Program:
+    """追踪一次函数调用得到的扁平运算序列
+
+    每个运算是(Function, 输入槽位, 输出槽位)，槽位是values列表中的下标。
+    前向传播依次调用各个Function的forward，反向传播倒序调用vjp，全程只处理ndarray
+
+    fn: 被追踪的函数
+    nodes: 运算序列
+    num_slots: 槽位数量
+    shapes, dtypes: 槽位 -> 形状和数据类型
+    arg_slots: 参数的槽位，没有被使用的参数为None
+    captured: 追踪时被fn引用的外部变量(比如全局的参数W、b)，作为编译后运算的额外输入
+    captured_slots: captured的槽位
+    consts: 槽位 -> 常量的数据，追踪结束后已经被回收的叶子变量(比如as_array包装的标量)
+    output_slots: 输出的槽位
+    multiple: fn是否返回多个输出
+    plans, arenas: 内存规划和可以复用的arena，见dezero.passes.MemoryPlan
+    drops: (nodes, 没有内存规划且不需要反向传播时每个运算之后可以释放的槽位)，nodes被优化修改后重新计算
+    files: 追踪时执行过的Python源文件(不包括numpy)，fn调用的辅助函数修改后磁盘缓存随之失效，
+        见DiskCache。追踪时已经有profiler(比如cProfile)时无法记录，为None
+    sources: DiskCache保存时记录的files中每个文件的哈希
+    """
+
+    def __init__(self, fn, args):
+        self.fn = fn
+        tape = Tape()
+        self.files = None
+        self.sources = None
+        if sys.getprofile() is None:
+            files = set()
+
+            def profile(frame, event, arg):
+                if event == "call":
+                    files.add(frame.f_code.co_filename)
+
+            sys.setprofile(profile)
+            try:
+                with tape.recording():
+                    outs = fn(*args)
+            finally:
+                sys.setprofile(None)
+            numpy_dir = os.path.dirname(np.__file__) + os.sep
+            # <stdin>、<frozen ...>等没有对应的文件，numpy的变化由版本号体现
+            self.files = sorted(
+                f for f in files if not f.startswith("<") and not f.startswith(numpy_dir)
+            )
+        else:
+            with tape.recording():
+                outs = fn(*args)
+        self.multiple = isinstance(outs, (tuple, list))
+        if not self.multiple:
+            outs = (outs,)
+
+        self.nodes = []
+        for i in range(len(tape)):
+            f, ins, outs_ = tape.row(i)
+            self.nodes.append((f, tuple(ins), tuple(outs_)))
+        self.num_slots = tape.num_slots
+        self.shapes = list(tape.shapes)
+        self.dtypes = list(tape.dtypes)
+        self.arg_slots = tuple([tape.slot(x) for x in args])
+        self.output_slots = []
+        for y in outs:
+            s = tape.slot(y)
+            if s is None:
+                raise ValueError("jit: output {} is not computed from recorded Functions".format(y))
+            self.output_slots.append(s)
+
+        args_set = set(s for s in self.arg_slots if s is not None)
+        self.captured = []
+        self.captured_slots = []
+        for s, ref in sorted(tape.leaves.items()):
+            x = ref()
+            if s not in args_set and x is not None:
+                self.captured.append(x)
+                self.captured_slots.append(s)
+        produced = set(tape.out_slots)
+        self.consts = {}
+        for s in range(self.num_slots):
+            if s in produced or s in args_set or s in tape.leaves:
+                continue
+            self.consts[s] = tape.data[s]
+        self.input_slots = tuple(self.arg_slots) + tuple(self.captured_slots)
+        self.plans = None  # 是否需要反向传播 -> MemoryPlan，由dezero.passes.plan_memory设置
+        self.arenas = {True: [], False: []}
+        self.drops = None
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def __getstate__(self):
+        # fn和captured变量属于当前进程，arena只是可以复用的缓冲区，都不需要序列化
+        state = dict(self.__dict__)
+        state["fn"] = None
+        state["captured"] = []
+        state["arenas"] = {True: [], False: []}
+        return state
+
+    def acquire(self, train):
+        """取出一个可以复用的arena(见dezero.passes.MemoryPlan)，没有内存规划时返回None"""
+        if self.plans is None:
+            return None
+        try:
+            return self.arenas[train].pop()
+        except IndexError:  # 没有空闲的arena，比如上一次执行还没有反向传播
+            return self.plans[train].allocate()
+
+    def release(self, train, arena):
+        """归还arena，之后的执行会复用其中的缓冲区"""
+        if arena is not None:
+            self.arenas[train].append(arena)
+
+    def run(self, xs, train=True, arena=None):
+        """依次执行记录的forward，返回所有槽位的值
+
+        xs: 参数和captured的数据(ndarray)
+        train: 之后是否需要反向传播，决定使用哪个内存规划
+        arena: acquire得到的缓冲区，为None时不使用内存规划，train为True时保留所有槽位的值，
+            否则在每个槽位最后一次被使用后释放它
+        """
+        values = [None] * self.num_slots
+        for s, x in self.consts.items():
+            values[s] = x
+        for s, x in zip(self.input_slots, xs):
+            if s is not None:
+                values[s] = x
+        if arena is None:
+            drops = None
+            if not train:
+                if self.drops is None or self.drops[0] is not self.nodes:
+                    self.drops = (self.nodes, passes.last_uses(self.nodes, self.output_slots))
+                drops = self.drops[1]
+            for k, (f, ins, outs) in enumerate(self.nodes):
+                ys = f.forward(*[values[s] for s in ins])
+                if len(outs) == 1:
+                    values[outs[0]] = ys if type(ys) is np.ndarray else as_array(ys)
+                else:
+                    for s, y in zip(outs, ys):
+                        values[s] = y if y is None else as_array(y)
+                if drops is not None:
+                    for s in drops[k]:
+                        values[s] = None
+            return values
+
+        for (f, ins, outs), (mode, buf, fresh, drop) in zip(self.nodes, self.plans[train].steps):
+            args = [values[s] for s in ins]
+            if mode == 1:
+                values[outs[0]] = f.forward_into(arena[buf], *args)
+            else:
+                if mode == 0:
+                    ys = f.forward(*args)
+                else:
+                    bufs = [arena[b] for b in buf]
+                    if fresh is not None:  # 输出会离开这次执行，不能放在复用的缓冲区中
+                        bufs[fresh] = np.empty_like(bufs[fresh])
+                    ys = f.compute(bufs, train, args)
+                if len(outs) == 1:
+                    values[outs[0]] = ys if type(ys) is np.ndarray else as_array(ys)
+                else:
+                    for s, y in zip(outs, ys):
+                        values[s] = y if y is None else as_array(y)
+            for s in drop:
+                values[s] = None
+        return values
+
+    def vjp(self, values, gys, arena=None):
+        """倒序执行记录的vjp，返回参数和captured的梯度(ndarray或None)
+
+        同一个变量作为多个参数传入时共用一个槽位，梯度只在第一次出现的位置返回，其余为None
+
+        values: run的结果，gys: 各个输出的梯度
+        arena: run使用的arena，不为None时按照内存规划释放中间结果并在缓冲区中累积梯度
+        """
+        plan = None if arena is None else self.plans[True]
+        grad_buffers = {} if plan is None else plan.grad_buffers
+        grads = [None] * self.num_slots
+        for s, gy in zip(self.output_slots, gys):
+            if gy is not None:
+                grads[s] = gy if grads[s] is None else grads[s] + gy
+        for k in range(len(self.nodes) - 1, -1, -1):
+            f, ins, outs = self.nodes[k]
+            if len(outs) == 1:
+                node_gys = (grads[outs[0]],)
+                skip = node_gys[0] is None
+            else:
+                node_gys = [grads[s] for s in outs]
+                skip = all(g is None for g in node_gys)
+            if not skip:
+                gxs = f.vjp([values[s] for s in ins], [values[s] for s in outs], node_gys)
+                for s, gx in zip(ins, gxs):
+                    if gx is None:
+                        continue
+                    g = grads[s]
+                    if g is None:
+                        grads[s] = gx
+                        continue
+                    b = grad_buffers.get(s)
+                    buf = None if b is None else arena[b]
+                    if buf is not None and g.shape == buf.shape and gx.shape == buf.shape:
+                        grads[s] = np.add(g, gx, out=buf)
+                    else:
+                        grads[s] = g + gx
+            if plan is not None:
+                for s in outs:
+                    grads[s] = None
+                for s in plan.back_drop[k]:
+                    values[s] = None
+
+        gxs = []
+        seen = set()
+        for s in self.input_slots:
+            gxs.append(None if s is None or s in seen else grads[s])
+            seen.add(s)
+        if grad_buffers:  # 返回的梯度可能是累积缓冲区的视图(比如Add的vjp直接返回gy)
+            bufs = [arena[b] for b in grad_buffers.values()]
+            for i, gx in enumerate(gxs):
+                if gx is not None and any(np.may_share_memory(gx, b) for b in bufs):
+                    gxs[i] = gx.copy()
+        return gxs
+
+    def recompute(self, *xs):
+        """在计算图上重新执行fn，captured变量由fn自己引用，不需要传入"""
+        return self.fn(*xs[: len(self.arg_slots)])
+
+
+class Compiled(Checkpoint):
+    """把Program作为一个整体的Function：整段计算只创建一个Function和它的输出变量
+
+    需要高阶导数(create_graph=True)时退回到Checkpoint的做法，在计算图上重新执行fn
+    """
+
+    __slots__ = ("program", "values", "arena")
+
+    def __init__(self, program):
+        super().__init__(program.recompute)
+        self.program = program
+        self.values = None
+        self.arena = None
+
+    def forward(self, *xs):
+        program = self.program
+        train = Config.enable_backprop and not Config.inference
+        arena = program.acquire(train)
+        values = program.run(xs, train, arena)
+        ys = tuple([values[s] for s in program.output_slots])
+        if train:  # 只有需要反向传播时才保留中间结果，arena在反向传播之后归还
+            self.values = values
+            self.arena = arena
+        else:
+            program.release(train, arena)
+        return ys if len(ys) > 1 else ys[0]
+
+    def backward(self, *gys):
+        if Config.enable_backprop or self.values is None or Config.tangents is not None:
+            return super().backward(*gys)  # 切向量只能沿着计算图传播
+        gxs = self.program.vjp(
+            self.values, [None if gy is None else gy.data for gy in gys], self.arena
+        )
+        self.program.release(True, self.arena)
+        self.values = None  # 中间结果只用于一次反向传播
+        self.arena = None
+        return tuple([None if gx is None else Variable(as_array(gx)) for gx in gxs])
+
+
+CacheInfo = collections.namedtuple(
+    "CacheInfo", ["hits", "misses", "evictions", "maxsize", "currsize"]
+)
+
+# 不影响追踪结果的配置，不作为缓存的键：由Compiled在执行时处理，或者只对逐个执行的Function有效
+# (Program.run直接调用forward，不会分块执行逐元素运算；化简只发生在create_graph=True的反向传播中)
+_RUNTIME_CONFIG = (
+    "enable_backprop",
+    "inference",
+    "tape",
+    "tangents",
+    "subexpressions",
+    "simplify",
+    "elementwise_threshold",
+    "elementwise_workers",
+)
+
+
+class TraceCache:
+    """按照签名缓存Program，超过maxsize时淘汰最久没有使用的Program(LRU)
+
+    maxsize: 最多保存的Program数量，None表示不限制
+    hits, misses, evictions: 命中、未命中和淘汰的次数
+    """
+
+    def __init__(self, maxsize=32):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._programs = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._programs)
+
+    def __contains__(self, key):
+        return key in self._programs
+
+    def get(self, key):
+        with self._lock:
+            program = self._programs.get(key)
+            if program is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._programs.move_to_end(key)
+            return program
+
+    def put(self, key, program):
+        with self._lock:
+            self._programs[key] = program
+            self._programs.move_to_end(key)
+            if self.maxsize is not None:
+                while len(self._programs) > self.maxsize:
+                    self._programs.popitem(last=False)
+                    self.evictions += 1
+
+    def values(self):
+        return list(self._programs.values())
+
+    def clear(self):
+        with self._lock:
+            self._programs.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def info(self):
+        return CacheInfo(self.hits, self.misses, self.evictions, self.maxsize, len(self))
+
+
+def signature(args):
+    """缓存的键：参数的形状和数据类型、哪些参数是同一个变量，以及当前上下文中会影响追踪结果的配置
+
+    jf(x, x)追踪得到的Program中两个参数共用一个槽位，不能用于jf(a, b)
+    """
+    first = {}
+    aliases = tuple([first.setdefault(id(x), i) for i, x in enumerate(args)])
+    config = tuple(
+        sorted(
+            (name, value)
+            for name, value in vars(_config.get()).items()
+            if name not in _RUNTIME_CONFIG
+        )
+    )
+    return tuple([(x.shape, x.dtype) for x in args]), aliases, config
+
+
+def _file_hashes(files):
+    """每个文件的内容的哈希，文件已经不存在时为None"""
+    hashes = []
+    for path in files:
+        try:
+            with open(path, "rb") as f:
+                hashes.append(hashlib.sha256(f.read()).hexdigest())
+        except OSError:
+            hashes.append(None)
+    return hashes
+
+
+def _value_token(x):
+    """可以作为缓存的键的表示，数组使用数据的哈希。不支持的类型抛出TypeError"""
+    if x is None or isinstance(x, (bool, int, float, complex, str, bytes)):
+        return repr(x)
+    if isinstance(x, Variable):
+        x = x.data
+    if isinstance(x, (np.ndarray, np.generic)):
+        x = np.ascontiguousarray(x)
+        if x.dtype.hasobject:
+            raise TypeError("object array")
+        return ("ndarray", x.dtype.str, x.shape, hashlib.sha256(x.tobytes()).hexdigest())
+    if isinstance(x, (tuple, list)):
+        return (type(x).__name__,) + tuple([_value_token(v) for v in x])
+    if isinstance(x, dict):
+        return ("dict",) + tuple(sorted((repr(k), _value_token(v)) for k, v in x.items()))
+    raise TypeError("unsupported value {!r}".format(type(x).__name__))
+
+
+def _object_token(x):
+    """闭包变量和全局变量的表示，模块、类和函数只使用名字"""
+    if inspect.ismodule(x):
+        return ("module", x.__name__)
+    if inspect.isclass(x) or inspect.isroutine(x):
+        return ("callable", getattr(x, "__module__", None), getattr(x, "__qualname__", None))
+    return _value_token(x)
+
+
+def _global_names(code):
+    """code和其中嵌套的函数(lambda、推导式)引用的名字"""
+    names = set(code.co_names)
+    for c in code.co_consts:
+        if inspect.iscode(c):
+            names |= _global_names(c)
+    return names
+
+
+def _function_hash(fn):
+    """fn的源代码和追踪时会被当作常量的值(闭包变量、默认参数、引用的全局变量，
+    functools.partial绑定的参数)的哈希
+
+    这些值在Program中被固定为consts，不同的值必须使用不同的缓存。模块、类和函数按照名字区分，
+    它们的代码由Program.files检查。无法确定时(比如可调用对象和方法的状态、不支持的值)返回None
+    """
+    try:
+        if isinstance(fn, functools.partial):
+            inner = _function_hash(fn.func)
+            if inner is None:
+                return None
+            token = ("partial", inner, _value_token(fn.args), _value_token(fn.keywords))
+            return hashlib.sha256(repr(token).encode()).hexdigest()
+        if not inspect.isfunction(fn):
+            return None
+        code = fn.__code__
+        try:
+            source = inspect.getsource(fn)
+        except (OSError, TypeError):
+            source = code.co_code.hex()
+        values = []
+        for name, cell in zip(code.co_freevars, fn.__closure__ or ()):
+            try:
+                values.append((name, _object_token(cell.cell_contents)))
+            except ValueError:  # 还没有赋值的闭包变量
+                values.append((name, None))
+        values.append(_value_token(fn.__defaults__))
+        values.append(_value_token(fn.__kwdefaults__))
+        for name in sorted(_global_names(code)):
+            if name in fn.__globals__:
+                values.append((name, _object_token(fn.__globals__[name])))
+    except TypeError:
+        return None
+    token = (source, tuple(values))
+    return hashlib.sha256(repr(token).encode()).hexdigest()
+
+
+class DiskCache:
+    """把优化后的Program用pickle保存在目录中，新进程可以直接加载而不需要重新追踪和优化
+
+    文件名由fn的源代码和被固定为常量的值的哈希(见_function_hash)、签名、optimize以及
+    dezero和numpy的版本决定，任何一项变化都会使用新的文件，无法计算哈希的fn不使用磁盘缓存。
+    fn调用的辅助函数等追踪时执行过的源文件(Program.files)的哈希保存在Program中，
+    加载时其中任何一个文件发生变化都会重新追踪并覆盖缓存。
+    引用了外部变量(captured不为空)或者没有记录files的Program不会被保存，
+    这种函数需要把参数作为实参传入才能使用磁盘缓存。
+    只应该使用可信的目录，加载时会执行pickle
+    """
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def filename(self, fn, key, optimize):
+        """缓存文件的路径，fn无法计算哈希时为None"""
+        digest = _function_hash(fn)
+        if digest is None:
+            return None
+        token = repr(
+            (
+                digest,
+                getattr(fn, "__module__", None),
+                getattr(fn, "__qualname__", None),
+                key,
+                optimize,
+                dezero.__version__,
+                np.__version__,
+            )
+        )
+        return os.path.join(self.path, hashlib.sha256(token.encode()).hexdigest() + ".pkl")
+
+    def load(self, fn, key, optimize):
+        path = self.filename(fn, key, optimize)
+        if path is None:
+            return None
+        try:
+            with open(path, "rb") as f:
+                program = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+            return None  # 没有缓存，或者缓存文件已经损坏、与当前代码不兼容
+        sources = getattr(program, "sources", None)
+        if sources is None or _file_hashes(program.files) != sources:
+            return None  # 追踪时执行过的源文件已经被修改
+        program.fn = fn
+        return program
+
+    def save(self, fn, key, optimize, program):
+        path = self.filename(fn, key, optimize)
+        if path is None or program.captured or program.files is None:
+            return False
+        # 加载的Program由dezero.jit和dezero.passes执行，它们不一定在追踪时执行过
+        program.files = sorted(set(program.files) | {__file__, passes.__file__})
+        program.sources = _file_hashes(program.files)
+        try:
+            data = pickle.dumps(program, protocol=pickle.HIGHEST_PROTOCOL)
+        except (pickle.PicklingError, TypeError, AttributeError):
+            return False  # 比如Function中保存了lambda
+        # 先写入临时文件再改名，多个进程同时启动时不会读到写了一半的文件
+        fd, tmp = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+        return True
+
+
+class JitFunction:
+    """dezero.jit返回的可调用对象，按照签名(见signature)缓存追踪结果
+
+    programs: 缓存追踪结果的TraceCache
+    optimize: 是否对追踪得到的Program执行dezero.passes中的优化
+    disk: 保存在磁盘上的缓存(DiskCache)，为None时不使用
+    """
+
+    def __init__(self, fn, optimize=True, maxsize=32, cache_dir=None):
+        self.fn = fn
+        self.programs = TraceCache(maxsize)
+        self.optimize = optimize
+        self.disk = None if cache_dir is None else DiskCache(cache_dir)
+        functools.update_wrapper(self, fn)
+
+    def __call__(self, *args):
+        args = [x if isinstance(x, Variable) else Variable(as_array(x)) for x in args]
+        key = signature(args)
+        program = self.programs.get(key)
+        if program is None:
+            program = self._compile(args, key)
+            self.programs.put(key, program)
+        ys = Compiled(program)(*args, *program.captured)
+        if program.multiple:
+            return tuple(ys) if isinstance(ys, list) else (ys,)
+        return ys
+
+    def _compile(self, args, key):
+        if self.disk is not None:
+            program = self.disk.load(self.fn, key, self.optimize)
+            if program is not None:
+                return program
+        program = Program(self.fn, args)
+        if self.optimize:
+            passes.optimize(program)
+        if self.disk is not None:
+            self.disk.save(self.fn, key, self.optimize, program)
+        return program
+
+    def cache_info(self):
+        """缓存的命中、未命中和淘汰次数"""
+        return self.programs.info()
+
+
+def jit(fn=None, optimize=True, maxsize=32, cache_dir=None):
+    """追踪编译的装饰器，可以写作@jit或者@jit(optimize=False)
+
+    第一次调用时记录fn中经过Function.__call__的运算，之后形状和数据类型相同的调用直接回放
+    记录的forward和vjp，不再为每个运算创建Variable和Function。
+    fn的控制流只在追踪时执行一次，不能依赖参数的具体数值；fn引用的外部变量(比如参数)
+    会作为额外的输入，梯度照常累积到它们的grad上。
+    编译后的运算不经过Function.__call__，Config.elementwise_threshold的分块执行(见dezero.parallel)
+    对它们无效，需要分块时不要使用jit
+
+    optimize: 是否对追踪结果执行dezero.passes中的优化(比如逐元素运算的融合)
+    maxsize: 最多缓存多少个签名的追踪结果，超过时淘汰最久没有使用的，None表示不限制
+    cache_dir: 把追踪结果保存在这个目录中，之后的进程可以直接加载；fn和追踪时执行过的源文件
+        (比如fn调用的辅助函数所在的模块)发生变化时重新追踪，见DiskCache
+    """
+    if fn is None:
+        return lambda fn: JitFunction(fn, optimize, maxsize, cache_dir)
+    return JitFunction(fn, optimize, maxsize, cache_dir)
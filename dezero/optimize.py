@@ -0,0 +1,79 @@
+import numpy as np
+
+from dezero.core import Variable, as_variable, no_grad, _backprop
+from dezero.transforms import hvp
+
+
+def _value_and_grad(f, x):
+    """f在x处的值和梯度(ndarray)，只对x求梯度，不修改其他变量的grad"""
+    x = Variable(x)
+    y = f(x)
+    gx = _backprop([(y, Variable(np.ones_like(y.data)))], inputs=[x])[0]
+    return float(y.data), np.zeros_like(x.data) if gx is None else gx.data
+
+
+def _conjugate_gradient(matvec, b, tol, maxiter):
+    """截断的共轭梯度法：近似求解A p = b，A只通过matvec出现
+
+    遇到非正曲率的方向时停止，返回当前的解(第一步就遇到时返回b，即最速下降方向)
+    """
+    p = np.zeros_like(b)
+    r = b.copy()
+    d = r.copy()
+    rr = np.vdot(r, r)
+    for _ in range(maxiter):
+        Ad = matvec(d)
+        curvature = np.vdot(d, Ad)
+        if curvature <= 0:
+            return b.copy() if not p.any() else p
+        alpha = rr / curvature
+        p += alpha * d
+        r -= alpha * Ad
+        rr_new = np.vdot(r, r)
+        if np.sqrt(rr_new) <= tol:
+            break
+        d *= rr_new / rr
+        d += r
+        rr = rr_new
+    return p
+
+
+def newton_cg(f, x0, maxiter=50, tol=1e-8, cg_maxiter=None, callback=None):
+    """用Newton-CG法求标量函数f的极小值点
+
+    每次迭代用反向传播求梯度g，再用共轭梯度法近似求解H p = -g。海森矩阵H只通过dezero.hvp
+    以矩阵向量积的形式出现，内存与参数的个数成正比，参数有上百万个时同样适用。
+    共轭梯度的精度随梯度的减小而提高(截断牛顿法)，步长用回溯直线搜索确定
+    param: f  接受Variable、返回标量Variable的函数
+    param: x0  初始值(Variable或ndarray)
+    param: maxiter  牛顿迭代的最大次数
+    param: tol  梯度的范数小于tol时停止
+    param: cg_maxiter  每次共轭梯度的最大迭代次数，默认为参数的个数与200中较小的一个
+    param: callback  每次迭代之后以当前的x(ndarray)调用
+    返回极小值点(ndarray)
+    """
+    x = np.array(as_variable(x0).data, dtype=np.float64)
+    if cg_maxiter is None:
+        cg_maxiter = min(x.size, 200)
+
+    def value(x):
+        with no_grad():
+            return float(f(Variable(x)).data)
+
+    fx, g = _value_and_grad(f, x)
+    for _ in range(maxiter):
+        gnorm = np.linalg.norm(g)
+        if gnorm <= tol:
+            break
+        p = _conjugate_gradient(
+            lambda d: hvp(f, x, d).data, -g, min(0.5, np.sqrt(gnorm)) * gnorm, cg_maxiter
+        )
+        # 回溯直线搜索(Armijo条件)，牛顿方向通常直接接受步长1
+        step, slope = 1.0, np.vdot(g, p)
+        while step > 1e-10 and value(x + step * p) > fx + 1e-4 * step * slope:
+            step *= 0.5
+        x = x + step * p
+        fx, g = _value_and_grad(f, x)
+        if callback is not None:
+            callback(x)
+    return x
@@ -0,0 +1,194 @@
+import concurrent.futures
+import contextvars
+import math
+import threading
+
+import numpy as np
+
+from dezero.core import Constant, using_config, _accumulate_grad, _edge_key
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+CHUNK_SIZE = 1 << 15  # 分块执行逐元素运算时每块的元素个数，float64时为256KB，能放进L2缓存
+
+
+def get_pool(workers, kind="backward"):
+    """线程数为workers的线程池，同样的kind和线程数在进程中共用一个线程池
+
+    param: kind  反向传播的任务("backward")会等待逐元素运算的分块("kernel")，两者使用不同的线程池以免死锁
+    """
+    with _pools_lock:
+        pool = _pools.get((kind, workers))
+        if pool is None:
+            pool = _pools[kind, workers] = concurrent.futures.ThreadPoolExecutor(
+                max_workers=workers, thread_name_prefix="dezero-" + kind
+            )
+        return pool
+
+
+def elementwise(f, xs, config):
+    """把逐元素运算f(定义了ufunc的Function)分成若干块，在线程池中用f.forward_into执行
+
+    元素个数不少于config.elementwise_threshold、并且每个输入要么与输出形状相同且C连续、要么只有一个元素时
+    才分块，否则返回None，由调用者执行普通的forward。输出被分成config.elementwise_workers段，
+    每个线程按CHUNK_SIZE逐块计算自己的一段；numpy在ufunc中会释放GIL，多个核可以同时计算。
+    反向传播由同样的Function组成，因此也会分块执行
+    """
+    shape = None
+    for x in xs:
+        if x.size > 1:
+            shape = x.shape
+            break
+    if shape is None:
+        return None
+    n = math.prod(shape)
+    if n < config.elementwise_threshold:
+        return None
+    flat = []
+    for x in xs:
+        if x.shape == shape and x.flags.c_contiguous:
+            flat.append(x.reshape(-1))
+        elif x.size == 1 and x.ndim <= len(shape):
+            flat.append(x.reshape(()))
+        else:
+            return None  # 需要真正的广播或者不连续，交给numpy
+
+    # 用第一个元素确定输出的dtype，与forward的类型提升规则保持一致
+    probe = f.forward(*[x[:1] if x.ndim else x for x in flat])
+    out = np.empty(n, dtype=np.asarray(probe).dtype)
+
+    def work(lo, hi):
+        for i in range(lo, hi, CHUNK_SIZE):
+            j = min(i + CHUNK_SIZE, hi)
+            f.forward_into(out[i:j], *[x[i:j] if x.ndim else x for x in flat])
+
+    workers = max(1, min(config.elementwise_workers, -(-n // CHUNK_SIZE)))
+    step = -(-n // workers // CHUNK_SIZE) * CHUNK_SIZE
+    bounds = [(lo, min(lo + step, n)) for lo in range(0, n, step)]
+    pool = get_pool(config.elementwise_workers, "kernel")
+    futures = [pool.submit(work, lo, hi) for lo, hi in bounds[1:]]
+    work(*bounds[0])  # 第一段在当前线程中计算
+    for future in futures:
+        future.result()
+    f.setup(*xs)  # 分块时forward只看到了一部分输入
+    return out.reshape(shape)
+
+
+def _dependencies(creators):
+    """从creators出发可以到达的每个函数 -> 可以到达的函数中有多少条连接指向它的输出"""
+    deps = {f: 0 for f in creators}
+    stack = list(creators)
+    while stack:
+        f = stack.pop()
+        if f.edges is None:
+            raise RuntimeError(
+                "计算图已经被释放，需要再次反向传播时请在backward中指定retain_graph=True"
+            )
+        for x, creator, k in f.edges:
+            if creator is None:
+                continue
+            if creator not in deps:
+                deps[creator] = 0
+                stack.append(creator)
+            deps[creator] += 1
+    return deps
+
+
+def backprop(roots, retain_grad=False, create_graph=False, retain_graph=True, workers=4):
+    """多线程的反向传播，参数的含义见Variable.backward
+
+    一个函数所有输出的梯度都到齐之后就可以执行它的backward，互不依赖的分支(比如goldstein的两个因子)
+    在线程池中并行执行。numpy在较大的ufunc和矩阵乘法中会释放GIL，张量较大时可以利用多个核。
+    梯度的累积按照目标变量加锁；每个任务在调用者的上下文副本中执行，Config的设置对其中的运算同样有效
+    """
+    grads = {}
+    owned = {}
+    pending = {}
+    creators = []
+    for y, gy in roots:
+        key = _edge_key(y)
+        grads[key] = _accumulate_grad(grads.get(key), gy, create_graph, owned)
+        if y.creator is not None and y.creator not in creators:
+            creators.append(y.creator)
+    if not creators:
+        return
+
+    deps = _dependencies(creators)
+    locks = {}
+    for f in deps:
+        for x, creator, k in f.edges:
+            key = x if creator is None else (creator, k)
+            if key not in locks:
+                locks[key] = threading.Lock()
+    state_lock = threading.Lock()
+    remaining = [len(deps)]
+    errors = []
+    done = threading.Event()
+    pool = get_pool(workers)
+
+    def submit(f):
+        pool.submit(contextvars.copy_context().run, run, f)
+
+    def process(f):
+        """执行f的反向传播，返回因此变为可以执行的函数"""
+        gys = [grads.pop((f, i), None) for i in range(len(f.outputs))]
+        for output, gy in zip(f.outputs, gys):
+            owned.pop(id(gy), None)
+            y = output()
+            if y is not None:
+                y.grad = gy if retain_grad else None
+
+        with using_config("enable_backprop", create_graph):
+            gxs = f.backward(*gys)
+            if not isinstance(gxs, tuple):
+                gxs = (gxs,)
+            ready = []
+            for (x, creator, k), gx in zip(f.edges, gxs):
+                key = x if creator is None else (creator, k)
+                if gx is not None:
+                    with locks[key]:
+                        if creator is None:
+                            if type(x) is not Constant:
+                                x.grad = _accumulate_grad(x.grad, gx, create_graph, owned)
+                        else:
+                            grads[key] = _accumulate_grad(
+                                grads.get(key), gx, create_graph, owned
+                            )
+                            if not retain_graph and "outputs" in creator.saves:
+                                pending[key] = x
+                if creator is not None:
+                    with state_lock:
+                        deps[creator] -= 1
+                        if deps[creator] == 0:
+                            ready.append(creator)
+
+        if not retain_graph:
+            for i in range(len(f.outputs)):
+                pending.pop((f, i), None)
+            f.inputs = None
+            f.edges = None
+            f.outputs = None
+        return ready
+
+    def run(f):
+        try:
+            while f is not None:
+                ready = process(f)
+                with state_lock:
+                    remaining[0] -= 1
+                    if remaining[0] == 0:
+                        done.set()
+                for g in ready[1:]:
+                    submit(g)
+                f = ready[0] if ready else None  # 在当前线程中继续执行一个，减少调度开销
+        except BaseException as e:
+            errors.append(e)
+            done.set()
+
+    for f in creators:
+        if deps[f] == 0:
+            submit(f)
+    done.wait()
+    if errors:
+        raise errors[0]
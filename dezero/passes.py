@@ -0,0 +1,425 @@
+import numpy as np
+
+from dezero.core import Function, Config
+
+
+class FusedElementwise(Function):
+    """融合后的一串逐元素运算，作为Program中的一个运算执行
+
+    局部槽位0..n_in-1是外部输入，其余是内部的中间结果。前向传播按照预先规划好的缓冲区
+    用out=参数依次执行各个运算，不再需要的中间结果的缓冲区会被后面的运算复用(包括原地计算)。
+    反向传播只保存外部输入，由它们重新计算中间结果后倒序调用各个运算的vjp，
+    所以训练时占用的内存不会超过逐个执行
+
+    ops: (Function, 输入的局部槽位, 输出的局部槽位)的列表
+    root: 融合后唯一对外可见的输出的局部槽位
+    plans: 是否需要反向传播 -> (缓冲区的(形状, 数据类型)列表, 每个运算写入的缓冲区)，两者相同
+    replay: 反向传播时需要重新计算的运算的下标，以及每个运算之后可以释放的局部槽位
+    back_drop: 倒序处理完第k个运算后可以释放的局部槽位
+    """
+
+    __slots__ = ("ops", "n_in", "n_locals", "root", "plans", "replay", "back_drop")
+    saves = ("inputs",)
+
+    def __init__(self, ops, n_in, shapes, dtypes):
+        self.ops = ops
+        self.n_in = n_in
+        self.n_locals = len(shapes)
+        self.root = ops[-1][2]
+        plan = _plan_buffers(ops, n_in, shapes, dtypes)
+        self.plans = {True: plan, False: plan}
+
+        # 局部槽位 -> 倒序处理时最后一次使用它的运算
+        needed = {}
+        for k, (f, ins, out) in enumerate(ops):
+            saved = (ins if "inputs" in f.saves else ()) + ((out,) if "outputs" in f.saves else ())
+            for i in saved:
+                needed[i] = min(needed.get(i, k), k)
+        self.back_drop = [[] for _ in ops]
+        for i, k in needed.items():
+            self.back_drop[k].append(i)
+        # 只重新计算反向传播直接或间接需要的运算，不被需要的中间结果在最后一次使用后释放
+        required = set(needed)
+        steps = []
+        for k in range(len(ops) - 1, -1, -1):
+            f, ins, out = ops[k]
+            if out in required:
+                required.update(ins)
+                steps.append(k)
+        steps.reverse()
+        last = {}
+        for k in steps:
+            for i in ops[k][1]:
+                last[i] = k
+        drops = {}
+        for i, k in last.items():
+            if i not in needed:
+                drops.setdefault(k, []).append(i)
+        self.replay = [(k, tuple(drops.get(k, ()))) for k in steps]
+
+    def forward(self, *xs):
+        buffers, _ = self.plans[False]
+        return self.compute([np.empty(shape, dtype) for shape, dtype in buffers], False, xs)
+
+    def compute(self, bufs, train, xs):
+        """使用给定的缓冲区执行前向传播，bufs与plans[train]中的缓冲区一一对应"""
+        _, assign = self.plans[train]
+        values = list(xs) + [None] * (self.n_locals - self.n_in)
+        for (f, ins, out), b in zip(self.ops, assign):
+            values[out] = f.forward_into(bufs[b], *[values[i] for i in ins])
+        return values[self.root]
+
+    def jvp(self, xs, ys, txs):
+        # 切向量与前向传播一起逐个运算计算
+        values = list(xs) + [None] * (self.n_locals - self.n_in)
+        tangents = list(txs) + [None] * (self.n_locals - self.n_in)
+        for f, ins, out in self.ops:
+            args = [values[i] for i in ins]
+            values[out] = f.forward(*args)
+            targs = [tangents[i] for i in ins]
+            if any(t is not None for t in targs):
+                tangents[out] = f.jvp(args, [values[out]], targs)[0]
+        return (tangents[self.root],)
+
+    def vjp(self, xs, ys, gys):
+        values = list(xs) + [None] * (self.n_locals - self.n_in)
+        for k, drop in self.replay:
+            f, ins, out = self.ops[k]
+            values[out] = f.forward(*[values[i] for i in ins])
+            for i in drop:
+                values[i] = None
+        grads = [None] * self.n_locals
+        grads[self.root] = gys[0]
+        for k in range(len(self.ops) - 1, -1, -1):
+            f, ins, out = self.ops[k]
+            gy = grads[out]
+            if gy is not None:
+                gxs = f.vjp([values[i] for i in ins], [values[out]], (gy,))
+                for i, gx in zip(ins, gxs):
+                    if gx is not None:
+                        grads[i] = gx if grads[i] is None else grads[i] + gx
+            grads[out] = None
+            for i in self.back_drop[k]:
+                values[i] = None
+        return tuple(grads[: self.n_in])
+
+
+def _plan_buffers(ops, n_in, shapes, dtypes):
+    """给每个运算的输出分配缓冲区，最后一次被使用的中间结果的缓冲区可以复用"""
+    last_use = {}
+    for k, (f, ins, out) in enumerate(ops):
+        for i in ins:
+            last_use[i] = k
+    buffers = []
+    assign = []
+    buffer_of = {}
+    free = {}  # (形状, 数据类型) -> 可以复用的缓冲区
+    for k, (f, ins, out) in enumerate(ops):
+        # 先释放输入，输出可以直接写入输入的缓冲区
+        for i in set(ins):
+            if i >= n_in and last_use[i] == k:
+                free.setdefault((shapes[i], dtypes[i]), []).append(buffer_of[i])
+        key = (shapes[out], dtypes[out])
+        if free.get(key):
+            b = free[key].pop()
+        else:
+            b = len(buffers)
+            buffers.append(key)
+        buffer_of[out] = b
+        assign.append(b)
+    return buffers, assign
+
+
+def _consumers(program):
+    """每个槽位被使用的次数，Program的输出也算一次"""
+    counts = [0] * program.num_slots
+    for f, ins, outs in program.nodes:
+        for s in ins:
+            counts[s] += 1
+    for s in program.output_slots:
+        counts[s] += 1
+    return counts
+
+
+def fuse_elementwise(program):
+    """把Program中相连的逐元素运算(ufunc不为None的Function)融合为FusedElementwise
+
+    一个运算的输出只被同一组中的下一个运算使用时才会被合并，所以每组只有最后一个运算的输出
+    对外可见，融合后的运算放在这个位置不会破坏执行顺序
+    """
+    nodes = program.nodes
+    consumers = _consumers(program)
+    producer = {}  # 槽位 -> 产生它的运算的下标
+    group = list(range(len(nodes)))  # 运算的下标 -> 所在组的根(组中最后一个运算)
+    members = {k: [k] for k in range(len(nodes))}
+    for k, (f, ins, outs) in enumerate(nodes):
+        for s in outs:
+            producer[s] = k
+        if f.ufunc is None or len(outs) != 1:
+            continue
+        for s in set(ins):
+            j = producer.get(s)
+            if j is None or nodes[j][0].ufunc is None or consumers[s] != 1:
+                continue
+            for m in members.pop(group[j]):
+                group[m] = k
+                members[k].append(m)
+
+    new_nodes = []
+    for k, (f, ins, outs) in enumerate(nodes):
+        if group[k] != k:
+            continue  # 已经合并到后面的组中
+        if len(members[k]) == 1:
+            new_nodes.append((f, ins, outs))
+            continue
+        new_nodes.append(_fuse(program, [nodes[m] for m in sorted(members[k])]))
+    program.nodes = new_nodes
+    return program
+
+
+def _fuse(program, group_nodes):
+    internal = set(s for _, _, outs in group_nodes for s in outs)
+    inputs = []
+    for _, ins, _ in group_nodes:
+        for s in ins:
+            if s not in internal and s not in inputs:
+                inputs.append(s)
+    local = {s: i for i, s in enumerate(inputs)}
+    for _, _, outs in group_nodes:
+        local[outs[0]] = len(local)
+    slots = sorted(local, key=local.get)
+
+    ops = []
+    for f, ins, outs in group_nodes:
+        ops.append((f, tuple([local[s] for s in ins]), local[outs[0]]))
+
+    fused = FusedElementwise(
+        ops,
+        len(inputs),
+        [program.shapes[s] for s in slots],
+        [program.dtypes[s] for s in slots],
+    )
+    return fused, tuple(inputs), (slots[ops[-1][2]],)
+
+
+def _remap(program, mapping):
+    """把Program中对槽位的引用按照mapping替换"""
+    if not mapping:
+        return
+    program.nodes = [
+        (f, tuple([mapping.get(s, s) for s in ins]), outs) for f, ins, outs in program.nodes
+    ]
+    program.output_slots = [mapping.get(s, s) for s in program.output_slots]
+
+
+def fold_constants(program):
+    """预先计算只依赖常量的运算，结果作为新的常量；相同的常量只保留一个槽位
+
+    参数和captured变量是可以求导的输入，依赖它们的运算不会被折叠
+    """
+    consts = program.consts
+    mapping = {}
+    seen = {}
+    for s in sorted(consts):
+        x = consts[s]
+        key = (x.shape, x.dtype.str, x.tobytes())
+        if key in seen:
+            mapping[s] = seen[key]
+        else:
+            seen[key] = s
+    _remap(program, mapping)
+
+    nodes = []
+    for f, ins, outs in program.nodes:
+        if all(s in consts for s in ins):
+            ys = f.forward(*[consts[s] for s in ins])
+            if not isinstance(ys, tuple):
+                ys = (ys,)
+            for s, y in zip(outs, ys):
+                consts[s] = np.asarray(y)
+        else:
+            nodes.append((f, ins, outs))
+    program.nodes = nodes
+
+    used = set(program.output_slots)
+    for f, ins, outs in nodes:
+        used.update(ins)
+    program.consts = {s: x for s, x in consts.items() if s in used}
+    return program
+
+
+def _attributes(f):
+    """Function自身的参数，不包括与计算图相关的属性
+
+    包括子类__slots__中的属性，以及没有声明__slots__的子类保存在实例__dict__中的属性
+    """
+    values = []
+    for cls in type(f).__mro__:
+        if cls is Function:
+            break
+        for name in cls.__dict__.get("__slots__", ()):
+            values.append(getattr(f, name, None))
+    state = getattr(f, "__dict__", None)
+    if state:
+        values.append(tuple(sorted(state.items())))
+    return tuple(values)
+
+
+def eliminate_common_subexpressions(program):
+    """合并类型、参数和输入都相同的运算，后面的运算直接使用第一次计算的结果"""
+    mapping = {}
+    seen = {}
+    nodes = []
+    for f, ins, outs in program.nodes:
+        ins = tuple([mapping.get(s, s) for s in ins])
+        try:
+            key = (type(f), _attributes(f), ins)
+            hash(key)
+        except TypeError:  # 参数不能比较(比如ndarray)的运算不参与合并
+            nodes.append((f, ins, outs))
+            continue
+        first = seen.get(key)
+        if first is None:
+            seen[key] = outs
+            nodes.append((f, ins, outs))
+        else:
+            mapping.update(zip(outs, first))
+    program.nodes = nodes
+    program.output_slots = [mapping.get(s, s) for s in program.output_slots]
+    return program
+
+
+def _writes_into(f):
+    """f能否把结果写入预先分配的缓冲区(见Function.forward_into)"""
+    return f.ufunc is not None or type(f).forward_into is not Function.forward_into
+
+
+def last_uses(nodes, keep=()):
+    """每个运算执行之后不再被前向传播使用的槽位(不包括keep中的槽位，比如Program的输出)"""
+    last = {}
+    for k, (f, ins, outs) in enumerate(nodes):
+        for s in ins + outs:
+            last[s] = k
+    drops = [[] for _ in nodes]
+    for s, k in last.items():
+        if s not in keep:
+            drops[k].append(s)
+    return drops
+
+
+class MemoryPlan:
+    """Program在一种模式(是否需要反向传播)下的内存规划
+
+    根据每个槽位在前向和反向传播中最后一次被使用的时刻，尽早释放不再需要的中间结果，
+    并把不会离开这次执行的中间结果分配到可以复用的缓冲区上。一次执行使用的一组缓冲区称为arena，
+    形状固定时每次执行都可以复用同一个arena，不再为中间结果分配内存
+
+    buffers: 缓冲区的(形状, 数据类型)列表
+    steps: 每个运算的(执行方式, 缓冲区, 需要新分配的缓冲区, 前向传播后可以释放的槽位)
+        执行方式0调用forward；1调用forward_into写入缓冲区；
+        2是FusedElementwise，缓冲区是它内部使用的缓冲区列表，输出会离开这次执行时要新分配它的输出缓冲区
+    back_drop: 反向传播处理完第k个运算后可以释放的槽位
+    grad_buffers: 槽位 -> 累积多个梯度用的缓冲区
+    """
+
+    def __init__(self, program, train):
+        nodes = program.nodes
+        shapes, dtypes = program.shapes, program.dtypes
+        outputs = set(program.output_slots)
+        consumers = {}
+        for k, (f, ins, outs) in enumerate(nodes):
+            for s in ins:
+                consumers.setdefault(s, []).append(k)
+
+        # 反向传播需要的槽位 -> 倒序处理时最后一次使用它的运算
+        needed = {}
+        if train:
+            for k, (f, ins, outs) in enumerate(nodes):
+                saved = (ins if "inputs" in f.saves else ()) + (
+                    outs if "outputs" in f.saves else ()
+                )
+                for s in saved:
+                    needed[s] = min(needed.get(s, k), k)
+
+        def escapes(s):
+            return s in outputs or any(nodes[k][0].views for k in consumers.get(s, ()))
+
+        last = last_uses(nodes, outputs)
+        self.buffers = []
+        self.steps = []
+        buffer_of = {}
+        free = {}  # (形状, 数据类型) -> 可以复用的缓冲区
+        ends = {}  # k -> 第k个运算之后可以释放缓冲区的槽位
+
+        def release(k):
+            for s in ends.pop(k, ()):
+                free.setdefault((shapes[s], dtypes[s]), []).append(buffer_of[s])
+
+        for k, (f, ins, outs) in enumerate(nodes):
+            mode, buf, fresh = 0, None, None
+            if isinstance(f, FusedElementwise):
+                mode = 2
+                buffers, assign = f.plans[train]
+                buf = tuple(range(len(self.buffers), len(self.buffers) + len(buffers)))
+                self.buffers.extend(buffers)
+                if escapes(outs[0]):
+                    fresh = assign[-1]
+            elif len(outs) == 1 and _writes_into(f) and not escapes(outs[0]):
+                mode = 1
+                s = outs[0]
+                if f.ufunc is not None:
+                    release(k)  # 逐元素运算可以原地写入最后一次使用的输入
+                key = (shapes[s], dtypes[s])
+                if free.get(key):
+                    buf = free[key].pop()
+                else:
+                    buf = len(self.buffers)
+                    self.buffers.append(key)
+                buffer_of[s] = buf
+                if s not in needed:  # 反向传播需要的缓冲区在这次执行中不会被复用
+                    ends.setdefault(max(consumers.get(s, [k])), []).append(s)
+            release(k)
+
+            drop = tuple([s for s in last[k] if s not in needed])
+            self.steps.append((mode, buf, fresh, drop))
+
+        self.back_drop = [[] for _ in nodes]
+        for s, k in needed.items():
+            self.back_drop[k].append(s)
+
+        # 被多个运算使用的中间结果需要累积梯度，参数的梯度会返回给用户，不使用缓冲区
+        self.grad_buffers = {}
+        inputs = set(program.input_slots)
+        if train:
+            for s, ks in consumers.items():
+                count = len(ks) + (s in outputs)
+                if count > 1 and s not in inputs and s not in program.consts:
+                    if np.issubdtype(dtypes[s], np.floating):
+                        self.grad_buffers[s] = len(self.buffers)
+                        self.buffers.append((shapes[s], dtypes[s]))
+
+    @property
+    def nbytes(self):
+        """一个arena占用的字节数"""
+        return sum(
+            int(np.prod(shape, dtype=np.int64)) * np.dtype(dtype).itemsize
+            for shape, dtype in self.buffers
+        )
+
+    def allocate(self):
+        return [np.empty(shape, dtype) for shape, dtype in self.buffers]
+
+
+def plan_memory(program):
+    """为Program生成需要反向传播和不需要反向传播两种模式的MemoryPlan，见Program.run"""
+    program.plans = {True: MemoryPlan(program, True), False: MemoryPlan(program, False)}
+    return program
+
+
+def optimize(program):
+    """对Program依次执行所有优化"""
+    fold_constants(program)
+    eliminate_common_subexpressions(program)
+    fuse_elementwise(program)
+    plan_memory(program)
+    return program
@@ -0,0 +1,183 @@
+import array
+import contextlib
+import weakref
+import numpy as np
+
+from dezero.core import Variable, using_config
+
+
+class Tape:
+    """以结构数组（struct of arrays）的形式记录计算图
+
+    每个运算是表中的一行：opcode、输入槽位、输出槽位和generation都保存在紧凑的整数数组中，
+    变量的数据保存在槽位表data中。记录时不创建creator/inputs/outputs之间的连接，
+    反向传播只需要倒序遍历这些整数数组
+
+    opcodes: 第i行运算的类型在types中的下标
+    generations: 第i行运算的generation
+    in_ptr, in_slots: 第i行运算的输入槽位为in_slots[in_ptr[i]:in_ptr[i + 1]]
+    out_ptr, out_slots: 第i行运算的输出槽位为out_slots[out_ptr[i]:out_ptr[i + 1]]
+    funcs: 第i行运算的Function实例，只用来保存运算的参数(比如Pow的c)和forward中记录的形状
+    data: 槽位 -> ndarray，只保留叶子变量和反向传播需要读取的数据，其余为None
+    shapes, dtypes: 槽位 -> 形状和数据类型
+    leaves: 仍然存活的叶子变量的槽位 -> 变量的弱引用，反向传播结束后把梯度写回这些变量
+    """
+
+    def __init__(self):
+        self.types = []
+        self.opcodes = array.array("i")
+        self.generations = array.array("i")
+        self.in_ptr = array.array("q", [0])
+        self.in_slots = array.array("q")
+        self.out_ptr = array.array("q", [0])
+        self.out_slots = array.array("q")
+        self.funcs = []
+
+        self.data = []
+        self.shapes = []
+        self.dtypes = []
+        self.slot_generations = array.array("i")
+        self.leaves = {}
+
+        self._opcode = {}  # 运算类型 -> opcode
+        self._index = {}  # id(存活的变量) -> (变量的弱引用, 槽位)
+
+    def __len__(self):
+        return len(self.opcodes)
+
+    @property
+    def num_slots(self):
+        return len(self.data)
+
+    @contextlib.contextmanager
+    def recording(self, enable_backprop=False):
+        """在with块中把所有运算记录到这条磁带上
+
+        enable_backprop: 是否同时创建普通的计算图，默认为False，只记录磁带
+        """
+        with using_config("tape", self), using_config(
+            "enable_backprop", enable_backprop
+        ), using_config("inference", False):  # 推理模式会跳过记录
+            yield self
+
+    def _new_slot(self, x, generation):
+        slot = len(self.data)
+        self.data.append(None)
+        self.shapes.append(x.shape)
+        self.dtypes.append(x.dtype)
+        self.slot_generations.append(generation)
+        # 变量被回收时从索引中删除，索引的大小只与仍然存活的变量数量有关
+        key = id(x)
+        self._index[key] = (weakref.ref(x, lambda ref: self._forget(key, slot)), slot)
+        return slot
+
+    def _forget(self, key, slot):
+        self._index.pop(key, None)
+        self.leaves.pop(slot, None)  # 已经回收的叶子变量不需要写回梯度
+
+    def slot(self, x):
+        """变量x的槽位，x不在磁带上时返回None"""
+        entry = self._index.get(id(x))
+        if entry is not None and entry[0]() is x:  # id可能被已经回收的变量使用过
+            return entry[1]
+        return None
+
+    def record(self, f, inputs, outputs):
+        opcode = self._opcode.get(type(f))
+        if opcode is None:
+            opcode = self._opcode[type(f)] = len(self.types)
+            self.types.append(type(f))
+
+        save_inputs = "inputs" in f.saves
+        generation = 0
+        for x in inputs:
+            s = self.slot(x)
+            if s is None:  # 第一次出现的变量是叶子变量，总是保留数据以便replay
+                s = self._new_slot(x, 0)
+                self.leaves[s] = self._index[id(x)][0]
+                self.data[s] = x.data
+            elif save_inputs:
+                self.data[s] = x.data
+            generation = max(generation, self.slot_generations[s])
+            self.in_slots.append(s)
+
+        save_outputs = "outputs" in f.saves
+        for y in outputs:
+            s = self._new_slot(y, generation + 1)
+            if save_outputs:
+                self.data[s] = y.data
+            self.out_slots.append(s)
+
+        self.opcodes.append(opcode)
+        self.generations.append(generation)
+        self.in_ptr.append(len(self.in_slots))
+        self.out_ptr.append(len(self.out_slots))
+        self.funcs.append(f)
+
+    def row(self, i):
+        """第i行运算的(Function, 输入槽位, 输出槽位)"""
+        ins = self.in_slots[self.in_ptr[i] : self.in_ptr[i + 1]]
+        outs = self.out_slots[self.out_ptr[i] : self.out_ptr[i + 1]]
+        return self.funcs[i], ins, outs
+
+    def to_arrays(self):
+        """以numpy数组的形式导出磁带的结构，便于检查和序列化"""
+        return {
+            "types": np.array([t.__name__ for t in self.types]),
+            "opcodes": np.frombuffer(self.opcodes, dtype=np.int32),
+            "generations": np.frombuffer(self.generations, dtype=np.int32),
+            "in_ptr": np.frombuffer(self.in_ptr, dtype=np.int64),
+            "in_slots": np.frombuffer(self.in_slots, dtype=np.int64),
+            "out_ptr": np.frombuffer(self.out_ptr, dtype=np.int64),
+            "out_slots": np.frombuffer(self.out_slots, dtype=np.int64),
+        }
+
+    def replay(self, feeds):
+        """按照记录的顺序重新执行前向传播
+
+        feeds: 叶子槽位 -> 新的ndarray，没有给出的叶子使用记录时的数据
+        返回所有槽位的计算结果
+        """
+        values = list(self.data)
+        for s, x in feeds.items():
+            values[s] = x
+        for i in range(len(self)):
+            f, ins, outs = self.row(i)
+            ys = f.forward(*[values[s] for s in ins])
+            if not isinstance(ys, tuple):
+                ys = (ys,)
+            for s, y in zip(outs, ys):
+                values[s] = np.asarray(y)
+        return values
+
+    def backward(self, y, gy=None):
+        """从变量y开始沿着磁带倒序进行反向传播，叶子变量的梯度累积到各自的grad上
+
+        gy: y的梯度(ndarray)，默认为全1
+        """
+        grads = [None] * self.num_slots
+        root = self.slot(y)
+        if root is None:
+            raise ValueError("{} is not recorded on this tape".format(y))
+        grads[root] = np.ones_like(y.data) if gy is None else gy
+
+        with using_config("tape", None), using_config("enable_backprop", False):
+            for i in reversed(range(len(self))):
+                f, ins, outs = self.row(i)
+                gys = [grads[s] for s in outs]
+                if all(g is None for g in gys):
+                    continue
+                xs = [self.data[s] for s in ins]
+                ys = [self.data[s] for s in outs]
+                gxs = f.vjp(xs, ys, gys)
+                for s, gx in zip(ins, gxs):
+                    if gx is not None:
+                        grads[s] = gx if grads[s] is None else grads[s] + gx
+                for s in outs:
+                    grads[s] = None
+
+            for s, ref in list(self.leaves.items()):
+                x = ref()
+                if x is not None and grads[s] is not None:
+                    gx = Variable(np.asarray(grads[s]))
+                    x.grad = gx if x.grad is None else x.grad + gx
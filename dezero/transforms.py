@@ -0,0 +1,352 @@
+import functools
+import math
+
+import numpy as np
+
+from dezero.core import Variable, as_array, as_variable, using_config
+from dezero.core import _backprop, _get_tangent, _set_tangent, _topological_order
+from dezero.jit import Program, TraceCache, signature
+
+
+def _tangent_table(inputs, tangents, name):
+    """检查切向量的形状，返回初始的切向量表(见dezero.core._set_tangent)"""
+    if len(inputs) != len(tangents):
+        raise ValueError("{}: got {} inputs but {} tangents".format(name, len(inputs), len(tangents)))
+    table = {}
+    for x, t in zip(inputs, tangents):
+        t = as_array(np.asarray(t.data if isinstance(t, Variable) else t))
+        if t.shape != x.shape:
+            raise ValueError(
+                "{}: tangent shape {} does not match input shape {}".format(name, t.shape, x.shape)
+            )
+        _set_tangent(table, x, t)
+    return table
+
+
+def jvp(f, primals, tangents):
+    """前向模式自动微分：计算f在primals处沿tangents方向的方向导数(雅可比矩阵乘以tangents)
+
+    前向传播的同时由每个Function的jvp传播切向量，不构建计算图。输入少、输出多时
+    (比如对np.linspace网格上的一组输出做灵敏度分析)只需要一次前向传播，比逐个输出反向传播便宜
+    param: f  接受Variable、返回Variable(或者它们的元组)的函数
+    param: primals  输入(Variable或ndarray)的元组或列表
+    param: tangents  与primals一一对应、形状相同的切向量
+    返回(f的输出, 输出的切向量)，都是Variable；f有多个输出时两者都是元组
+    """
+    inputs = [Variable(as_variable(x).data) for x in primals]  # 不修改调用者的变量
+    table = _tangent_table(inputs, tangents, "jvp")
+
+    with using_config("enable_backprop", False), using_config("inference", False), using_config(
+        "tangents", table
+    ):
+        outputs = f(*inputs)
+
+    multiple = isinstance(outputs, (tuple, list))
+    outputs = [as_variable(y) for y in (outputs if multiple else (outputs,))]
+    tys = []
+    for y in outputs:
+        t = _get_tangent(table, y)
+        # 与输入无关的输出切向量为0；广播得到的只读视图复制为普通的数组
+        tys.append(Variable(np.zeros_like(y.data) if t is None else np.array(t, dtype=y.data.dtype)))
+    if multiple:
+        return tuple(outputs), tuple(tys)
+    return outputs[0], tys[0]
+
+
+def _dependents(y, inputs):
+    """计算y的函数中依赖于inputs的函数，反向传播只需要执行它们"""
+    targets = set(id(x) for x in inputs)
+    needed = set()
+    if y.creator is None:
+        return needed
+    for f in reversed(list(_topological_order([y.creator]))):  # generation从小到大
+        for x, creator, k in f.edges:
+            if (creator is None and id(x) in targets) or creator in needed:
+                needed.add(f)
+                break
+    return needed
+
+
+def hvp(f, x, v):
+    """海森矩阵与向量的乘积H v，H是标量函数f在x处的海森矩阵
+
+    前向套反向(forward-over-reverse)：前向传播时沿v传播切向量，随后的反向传播由Function组成，
+    切向量同样流过这些运算，x的梯度的切向量就是H v。反向传播不创建计算图，只执行依赖于x的函数，
+    不需要像steps/step33.py那样对create_graph=True得到的二阶计算图再反向传播一次
+    param: f  接受Variable、返回标量Variable的函数
+    param: x  输入(Variable或ndarray)，多个输入时为元组或列表
+    param: v  与x形状相同的向量
+    返回H v(Variable)，多个输入时为元组
+    """
+    multiple = isinstance(x, (tuple, list))
+    xs, vs = (x, v) if multiple else ((x,), (v,))
+    inputs = [Variable(as_variable(x).data) for x in xs]
+    table = _tangent_table(inputs, vs, "hvp")
+
+    with using_config("enable_backprop", True), using_config("inference", False), using_config(
+        "tangents", table
+    ):
+        y = f(*inputs)
+        if y.size != 1:
+            raise ValueError("hvp: f must return a scalar, got shape {}".format(y.shape))
+        needed = _dependents(y, inputs)
+        gxs = _backprop([(y, Variable(np.ones_like(y.data)))], inputs=inputs, needed=needed)
+
+    hvs = []
+    for x, gx in zip(inputs, gxs):
+        t = None if gx is None else _get_tangent(table, gx)
+        hvs.append(Variable(np.zeros_like(x.data) if t is None else np.array(t, dtype=x.data.dtype)))
+    return tuple(hvs) if multiple else hvs[0]
+
+
+class Vmapped:
+    """dezero.vmap返回的可调用对象
+
+    用一个样本追踪fn得到Program(见dezero.jit)，然后在整批数据上依次执行各个运算的
+    forward_batched；grad按同样的方式倒序执行vjp_batched，一次求出每个样本各自的梯度。
+    不依赖批量输入的运算仍然用普通的forward执行一次
+
+    programs: 按照样本的签名和in_axes缓存追踪结果的TraceCache
+    """
+
+    def __init__(self, fn, in_axes=0, maxsize=32):
+        self.fn = fn
+        self.in_axes = in_axes
+        self.programs = TraceCache(maxsize)
+        functools.update_wrapper(self, fn)
+
+    def __call__(self, *args):
+        """返回fn在每个样本上的输出，批量维在第0维。不依赖批量输入的输出会被广播"""
+        program, xs, batched, size = self._prepare(args)
+        values, flags = self._run(program, xs, batched)
+        ys = []
+        for s in program.output_slots:
+            y = values[s]
+            if not flags[s]:
+                y = np.broadcast_to(y, (size,) + y.shape).copy()
+            ys.append(Variable(y))
+        if program.multiple:
+            return tuple(ys)
+        return ys[0]
+
+    def grad(self, *args, gys=None):
+        """每个样本的输出对每个参数的梯度，in_axes为None的参数(比如共享的权重)也会得到每个样本各自的梯度
+
+        一次批量的反向传播代替逐个样本调用Variable.backward
+        param: gys  每个样本的输出梯度(第0维是批量维)，默认为1，即每个样本的输出(比如损失)本身的梯度
+        返回与参数一一对应的梯度(Variable)，批量维的位置与in_axes相同，共享的参数的梯度批量维在第0维
+        """
+        program, xs, batched, size = self._prepare(args)
+        values, flags = self._run(program, xs, batched)
+
+        seeds = []
+        for i, s in enumerate(program.output_slots):
+            if gys is None:
+                y = values[s]
+                seeds.append(np.ones((size,) + (y.shape[1:] if flags[s] else y.shape), y.dtype))
+            else:
+                seeds.append(as_variable(gys[i] if program.multiple else gys).data)
+        grads = _backward_batched(program, values, flags, seeds)
+
+        gxs = []
+        for s, x, b, axis in zip(program.arg_slots, xs, batched, self._axes(args)):
+            g = None if s is None else grads[s]
+            if g is None:  # 输出与这个参数无关
+                g = np.zeros((size,) + (x.shape[1:] if b else x.shape), x.dtype)
+            g = np.array(g)  # 广播得到的只读视图复制为普通的数组
+            gxs.append(Variable(np.moveaxis(g, 0, axis) if b else g))
+        return tuple(gxs)
+
+    def _axes(self, args):
+        if isinstance(self.in_axes, (tuple, list)):
+            if len(self.in_axes) != len(args):
+                raise ValueError(
+                    "vmap: in_axes has {} entries but got {} arguments".format(len(self.in_axes), len(args))
+                )
+            return self.in_axes
+        return (self.in_axes,) * len(args)
+
+    def _prepare(self, args):
+        """把批量维移到第0维，用第一个样本追踪(或者从缓存中取出)Program"""
+        xs, batched, size = [], [], None
+        for x, axis in zip(args, self._axes(args)):
+            x = as_variable(x if isinstance(x, Variable) else as_array(x)).data
+            if axis is not None:
+                x = np.moveaxis(x, axis, 0)
+                if size is None:
+                    size = len(x)
+                elif len(x) != size:
+                    raise ValueError("vmap: batched arguments have different sizes {} and {}".format(size, len(x)))
+            xs.append(x)
+            batched.append(axis is not None)
+        if size is None:
+            raise ValueError("vmap: at least one argument must be batched")
+
+        samples = [Variable(x[0] if b else x) for x, b in zip(xs, batched)]
+        key = (signature(samples), tuple(batched))
+        program = self.programs.get(key)
+        if program is None:
+            program = Program(self.fn, samples)
+            self.programs.put(key, program)
+        return program, xs, batched, size
+
+    def _run(self, program, xs, batched):
+        """执行Program，返回每个槽位的值和它是否是批量的"""
+        values = [None] * program.num_slots
+        flags = [False] * program.num_slots
+        for s, x in program.consts.items():
+            values[s] = x
+        inputs = list(zip(xs, batched)) + [(x.data, False) for x in program.captured]
+        for s, (x, b) in zip(program.input_slots, inputs):
+            if s is not None:
+                values[s] = x
+                flags[s] = b
+        for f, ins, outs in program.nodes:
+            if len(outs) != 1:
+                raise NotImplementedError("vmap: Functions with multiple outputs are not supported")
+            args = [values[s] for s in ins]
+            bs = [flags[s] for s in ins]
+            if any(bs):
+                y = f.forward_batched(args, bs)
+            else:
+                y = f.forward(*args)
+            values[outs[0]] = as_array(y)
+            flags[outs[0]] = any(bs)
+        return values, flags
+
+
+def _backward_batched(program, values, flags, gys):
+    """倒序执行Program的vjp_batched，返回每个槽位的一批梯度(只计算依赖于参数的槽位)
+
+    values, flags: 各个槽位的值和它是否是批量的
+    gys: 各个输出的一批梯度(第0维是批量维)
+    """
+    requires = set(s for s in program.arg_slots if s is not None)
+    for f, ins, outs in program.nodes:
+        if any(s in requires for s in ins):
+            requires.update(outs)
+    grads = [None] * program.num_slots
+    for s, gy in zip(program.output_slots, gys):
+        grads[s] = gy if grads[s] is None else grads[s] + gy
+    for f, ins, outs in reversed(program.nodes):
+        gy = grads[outs[0]]
+        if gy is None or not any(s in requires for s in ins):
+            continue
+        gxs = f.vjp_batched(
+            [values[s] for s in ins],
+            [flags[s] for s in ins],
+            [values[outs[0]]],
+            (gy,),
+            needs=[s in requires for s in ins],
+        )
+        for s, gx in zip(ins, gxs):
+            if gx is not None and s in requires:
+                grads[s] = gx if grads[s] is None else grads[s] + gx
+    return grads
+
+
+def vmap(fn, in_axes=0):
+    """给由Function组成的fn增加批量维：返回的函数把每个样本分别传给fn的结果一次算出
+
+    param: fn  接受Variable、返回Variable(或者它们的元组)的函数
+    param: in_axes  每个参数的批量维的位置，为None的参数在所有样本之间共享；一个整数表示所有参数相同
+    返回Vmapped，调用它得到每个样本的输出，Vmapped.grad得到每个样本的梯度
+    """
+    return Vmapped(fn, in_axes)
+
+
+def jacobian(f, x, mode="auto"):
+    """f在x处的雅可比矩阵，形状为f(x).shape + x.shape
+
+    追踪f得到Program(见dezero.jit)后执行一次前向传播，然后
+        "reverse": 把每个输出元素的单位余切向量堆叠成一批，一次批量的反向传播(vjp_batched)求出所有行
+        "forward": 把每个输入元素的单位切向量堆叠成一批，一次批量的前向传播(jvp_batched)求出所有列
+        "auto": 输出的元素比输入少时使用reverse，否则使用forward
+    代替逐个输出元素调用backward。结果需要的内存与雅可比矩阵的大小相同
+    param: f  接受Variable、返回一个Variable的函数
+    param: x  输入(Variable或ndarray)，多个输入时为元组或列表
+    返回雅可比矩阵(Variable)，多个输入时为对应每个输入的元组
+    """
+    if mode not in ("auto", "forward", "reverse"):
+        raise ValueError("jacobian: unknown mode {!r}".format(mode))
+    multiple = isinstance(x, (tuple, list))
+    inputs = [Variable(as_variable(a).data) for a in (x if multiple else (x,))]
+    program = Program(f, inputs)
+    if program.multiple:
+        raise ValueError("jacobian: f must return a single Variable")
+    # 之后的反向或者前向传播需要所有槽位的值
+    values = program.run([a.data for a in inputs] + [c.data for c in program.captured], train=True)
+    y = values[program.output_slots[0]]
+    m = y.size
+    if mode == "auto":
+        mode = "reverse" if m < sum(a.size for a in inputs) else "forward"
+
+    jacobians = []
+    if mode == "reverse":
+        seeds = np.eye(m, dtype=y.dtype).reshape((m,) + y.shape)
+        grads = _backward_batched(program, values, [False] * program.num_slots, [seeds])
+        for a, s in zip(inputs, program.arg_slots):
+            g = None if s is None else grads[s]
+            j = np.zeros((m,) + a.shape, a.dtype) if g is None else np.array(g)
+            jacobians.append(j.reshape(y.shape + a.shape))
+    else:
+        for a, s in zip(inputs, program.arg_slots):
+            n = a.size
+            tangents = [None] * program.num_slots
+            if s is not None:
+                tangents[s] = np.eye(n, dtype=a.dtype).reshape((n,) + a.shape)
+            for fn, ins, outs in program.nodes:
+                txs = [tangents[i] for i in ins]
+                if any(t is not None for t in txs):
+                    tangents[outs[0]] = fn.jvp_batched(
+                        [values[i] for i in ins], [values[outs[0]]], txs
+                    )[0]
+            t = tangents[program.output_slots[0]]
+            if t is None:
+                j = np.zeros(y.shape + a.shape, y.dtype)
+            else:  # (n, *y.shape) -> y.shape + a.shape
+                j = np.ascontiguousarray(np.broadcast_to(t, (n,) + y.shape).reshape(n, m).T)
+                j = j.reshape(y.shape + a.shape)
+            jacobians.append(j)
+    jacobians = [Variable(j) for j in jacobians]
+    return tuple(jacobians) if multiple else jacobians[0]
+
+
+def taylor(f, x, k, v=None):
+    """泰勒模式：一次传播截断到k阶的幂级数，求出f在x处的0到k阶导数
+
+    追踪f得到Program(见dezero.jit)，输入的级数为x + v t，每个Function的taylor由低阶系数逐阶算出
+    高阶系数。代价随k大约按k的平方增长(级数乘法)，而不像反复backward(create_graph=True)那样
+    计算图随阶数指数膨胀。x为数组时求沿v方向的方向导数，v默认全为1，对逐元素的函数
+    (比如steps/step34.py中网格上的sin)就是每个点各自的导数
+    param: f  接受Variable、返回一个Variable的函数
+    param: x  输入(Variable或ndarray)
+    param: k  最高的导数阶数
+    param: v  方向，形状与x相同
+    返回(f(x), f'(x), ..., f的k阶导数)，都是Variable
+    """
+    x = Variable(as_variable(x).data)
+    program = Program(f, [x])
+    if program.multiple:
+        raise ValueError("taylor: f must return a single Variable")
+
+    def constant(value):
+        s = np.zeros((k + 1,) + value.shape, value.dtype)
+        s[0] = value
+        return s
+
+    series = [None] * program.num_slots
+    for s, value in program.consts.items():
+        series[s] = constant(value)
+    for s, c in zip(program.captured_slots, program.captured):
+        series[s] = constant(c.data)
+    s = program.arg_slots[0]
+    if s is not None:
+        series[s] = constant(x.data.astype(np.result_type(x.data, 1.0)))
+        if k >= 1:
+            series[s][1] = 1 if v is None else as_variable(v).data
+    for fn, ins, outs in program.nodes:
+        for o, y in zip(outs, fn.taylor([series[i] for i in ins])):
+            series[o] = y
+    coefficients = series[program.output_slots[0]]
+    return tuple([Variable(as_array(coefficients[j] * math.factorial(j))) for j in range(k + 1)])
@@ -1,26 +1,43 @@
 import os
 import subprocess
+import numpy as np
 
 
-def _dot_var(v, verbose=False):
+def _dot_var(v, verbose=False, node_id=None):
+    """node_id: 变量节点的id，中间变量可能已经被回收(v为None)，此时用连接的id代替"""
     dot_var = '{} [label="{}", color=orange, style=filled]\n'
 
-    name = "" if v.name is None else v.name
-    if verbose and v.data is not None:
+    name = "" if v is None or v.name is None else v.name
+    if verbose and v is not None and v.data is not None:
         if v.name is not None:
             name += ": "
         name += str(v.shape) + " " + str(v.dtype)
-    return dot_var.format(id(v), name)
+    return dot_var.format(id(v) if node_id is None else node_id, name)
+
+
+def _edge_id(edge):
+    """连接(变量, 创建者, 输出序号)所指向的变量节点的id"""
+    x, creator, k = edge
+    if creator is None:
+        return id(x)
+    return id(creator.outputs[k])  # 创建者持有的弱引用，变量被回收后依然存在
+
+
+def _edge_var(edge):
+    x, creator, k = edge
+    if x is None:
+        x = creator.outputs[k]()
+    return x
 
 
 def _dot_func(f):
     dot_func = '{} [label="{}", color=lightblue, style=filled, shape=box]'
     txt = dot_func.format(id(f), f.__class__.__name__)
     dot_edge = "{} -> {}\n"
-    for x in f.inputs:
-        txt += dot_edge.format(id(x), id(f))
+    for edge in f.edges:
+        txt += dot_edge.format(_edge_id(edge), id(f))
     for y in f.outputs:
-        txt += dot_edge.format(id(f), id(y()))  # y是weakref
+        txt += dot_edge.format(id(f), id(y))  # y是weakref，用它的id表示输出变量
     return txt
 
 
@@ -35,16 +52,19 @@ def get_dot_graph(output, verbose=True):
             seen_set.add(f)
 
     add_func(output.creator)
-    txt += _dot_var(output, verbose)
+    output_id = id(output)
+    if output.creator is not None:
+        output_id = next(id(y) for y in output.creator.outputs if y() is output)
+    txt += _dot_var(output, verbose, output_id)
 
     while funcs:
         func = funcs.pop()
         txt += _dot_func(func)
-        for x in func.inputs:
-            txt += _dot_var(x, verbose)
+        for edge in func.edges:
+            txt += _dot_var(_edge_var(edge), verbose, _edge_id(edge))
 
-            if x.creator is not None:
-                add_func(x.creator)
+            if edge[1] is not None:
+                add_func(edge[1])
 
     return "digraph g {\n" + txt + "}"
 
@@ -84,15 +104,44 @@ def sum_to(x, shape):
         y = y.squeeze(lead_axis)  # 压缩lead_axis指定的维度
     return y
 
-def reshape_sum_backward(gy, shape, axis, keepdims):
-    pivot_shape: tuple = (shape[0], 1)
+def sum_to_batched(x, shape):
+    """x的第0维是批量维，对每个样本分别求和到shape，结果的形状为(批量大小,) + shape"""
+    target = x.shape[:1] + (1,) * (x.ndim - 1 - len(shape)) + tuple(shape)
+    return sum_to(x, target).reshape(x.shape[:1] + tuple(shape))
+
+
+def align_batched(x, batched, ndim):
+    """把批量的x(第0维是批量维)的每个样本在前面补上长度为1的维度直到ndim维
 
-    if not gy.shape:
-        gy = gy.reshape((1,))
+    补齐之后批量维和其他输入(批量的或者不是批量的)可以直接按照numpy的规则广播
+    """
+    pad = ndim - (x.ndim - 1)
+    if not batched or pad <= 0:
+        return x
+    return x.reshape(x.shape[:1] + (1,) * pad + x.shape[1:])
+
+
+def cauchy_product(a, b, mul=np.multiply):
+    """截断幂级数的乘积：a、b的第0维是系数，结果的第j个系数为sum_i mul(a[i], b[j-i])"""
+    return np.stack([mul(a[: j + 1], b[j::-1]).sum(axis=0) for j in range(len(a))])
 
-    if axis == 0:
-        return gy.tile(pivot_shape)
-    elif axis == 1:
-        return gy.reshape(pivot_shape)
-    else: # when axis is None
-        return gy
\ No newline at end of file
+
+def reshape_sum_backward(gy, x_shape, axis, keepdims):
+    """把sum的输出梯度gy变形为可以广播回x_shape的形状
+
+    keepdims为False时被求和的维度已经消失，需要在这些位置重新插入长度为1的维度
+    """
+    ndim = len(x_shape)
+    tupled_axis = axis
+    if axis is not None and not isinstance(axis, tuple):
+        tupled_axis = (axis,)
+
+    if not (ndim == 0 or tupled_axis is None or keepdims):
+        actual_axis = [a if a >= 0 else a + ndim for a in tupled_axis]
+        shape = list(gy.shape)
+        for a in sorted(actual_axis):
+            shape.insert(a, 1)
+    else:
+        shape = gy.shape
+
+    return gy.reshape(shape)
@@ -0,0 +1,48 @@
+if "__file__" in globals():
+    import os, sys
+
+    sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+import unittest
+import numpy as np
+from dezero import Variable
+import dezero.functions as F
+
+
+class CheckpointTest(unittest.TestCase):
+    def test_captured_variable(self):
+        # fn引用的外部变量同样要得到梯度
+        W = Variable(np.array(2.0))
+        x = Variable(np.array(3.0))
+        F.checkpoint(lambda a: a * W, x).backward()
+        self.assertEqual(x.grad.data, 2.0)
+        self.assertEqual(W.grad.data, 3.0)
+
+    def test_captured_matmul(self):
+        rng = np.random.RandomState(0)
+        W = Variable(rng.randn(3, 4))
+        x = Variable(rng.randn(2, 3))
+        F.sum(F.tanh(F.matmul(x, W))).backward()
+        expected_x, expected_W = x.grad.data, W.grad.data
+        x.cleargrad()
+        W.cleargrad()
+        F.sum(F.checkpoint(lambda a: F.tanh(F.matmul(a, W)), x)).backward()
+        self.assertTrue(np.allclose(x.grad.data, expected_x))
+        self.assertTrue(np.allclose(W.grad.data, expected_W))
+
+    def test_repeated_input(self):
+        # 同一个变量作为多个参数传入时梯度只计算一次
+        x = Variable(np.array(3.0))
+        F.checkpoint(lambda a, b: a * b, x, x).backward()
+        self.assertEqual(x.grad.data, 6.0)
+
+    def test_repeated_input_with_captured(self):
+        W = Variable(np.array(5.0))
+        x = Variable(np.array(3.0))
+        F.checkpoint(lambda a, b: a * b * W + a, x, x).backward()
+        self.assertEqual(x.grad.data, 2 * 3.0 * 5.0 + 1)
+        self.assertEqual(W.grad.data, 9.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
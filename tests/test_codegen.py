@@ -0,0 +1,66 @@
+if "__file__" in globals():
+    import os, sys
+
+    sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+import inspect
+import unittest
+import numpy as np
+from dezero import Variable
+from dezero import codegen
+import dezero.functions as F
+
+
+class GeneratedVjpTest(unittest.TestCase):
+    def check(self, fn, arrays, captured=()):
+        """生成代码的forward和vjp与fn的前向传播和backward一致"""
+        module = codegen.load(codegen.generate(fn, *arrays))
+        # 按照生成的签名中的名字传入参数和captured变量，返回的梯度也是这个顺序
+        names = list(inspect.signature(module.vjp).parameters)[:-1]
+        values = dict(zip(names, arrays))
+        expected = {}
+        for p in captured:
+            p.cleargrad()
+            values[p.name] = p.data
+        xs = [Variable(a.copy()) for a in arrays]
+        y = fn(*xs)
+        gy = np.random.RandomState(0).randn(*y.shape)
+        y.grad = Variable(gy)
+        y.backward()
+        for name, x in zip(names, xs):
+            expected[name] = x.grad.data
+        for p in captured:
+            expected[p.name] = p.grad.data
+
+        self.assertTrue(np.allclose(module.forward(**values), y.data))
+        gxs = module.vjp(**values, gy=gy)
+        self.assertEqual(len(gxs), len(names))
+        for name, gx in zip(names, gxs):
+            self.assertEqual(gx.shape, expected[name].shape, name)
+            self.assertTrue(np.allclose(gx, expected[name]), name)
+
+    def test_broadcast(self):
+        # Add和Sub的梯度需要sum_to回到输入的形状
+        rng = np.random.RandomState(1)
+        self.check(lambda x, b: x + b, [rng.randn(4, 3), rng.randn(3)])
+        self.check(lambda x, b: b - x * 2, [rng.randn(4, 3), rng.randn(1, 3)])
+        self.check(lambda x, b: F.tanh(x - b) + b, [rng.randn(2, 4, 3), rng.randn(4, 1)])
+
+    def test_sum_axis(self):
+        # Sum的梯度需要reshape_sum_backward恢复被求和的轴
+        rng = np.random.RandomState(2)
+        x = rng.randn(4, 3, 2)
+        self.check(lambda x: F.sum(F.sin(x), axis=1, keepdims=True), [x])
+        self.check(lambda x: F.sum(x * x, axis=(0, 2)), [x])
+        self.check(lambda x: F.sum(x, axis=-1) * 3, [x])
+
+    def test_captured(self):
+        # fn引用的外部变量成为额外的输入，同样返回梯度
+        rng = np.random.RandomState(3)
+        W = Variable(rng.randn(3, 2), name="W")
+        bias = Variable(rng.randn(2), name="bias")
+        self.check(lambda x: F.sum(F.tanh(F.matmul(x, W) + bias), axis=0), [rng.randn(4, 3)], [W, bias])
+
+
+if __name__ == "__main__":
+    unittest.main()
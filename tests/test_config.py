@@ -0,0 +1,94 @@
+if "__file__" in globals():
+    import os, sys
+
+    sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+import asyncio
+import threading
+import unittest
+import numpy as np
+from dezero import Variable, Function, using_config, no_grad
+from dezero.core import Config
+
+
+class Record(Function):
+    """backward时记录当前上下文中的Config.elementwise_threshold"""
+
+    __slots__ = ()
+    seen = []
+
+    def forward(self, x):
+        return x * 2
+
+    def backward(self, gy):
+        Record.seen.append(Config.elementwise_threshold)
+        return gy * 2
+
+
+class ConfigIsolationTest(unittest.TestCase):
+    def test_threads(self):
+        # 一个线程停留在no_grad()中时，其他线程仍然构建计算图
+        x = Variable(np.array(1.0))
+        entered, leave = threading.Event(), threading.Event()
+        results = {}
+
+        def quiet():
+            with no_grad():
+                results["quiet"] = (x * 2).creator
+                entered.set()
+                leave.wait(timeout=5)
+
+        def loud():
+            results["loud"] = (x * 2).creator
+
+        t = threading.Thread(target=quiet)
+        t.start()
+        self.assertTrue(entered.wait(timeout=5))
+        other = threading.Thread(target=loud)
+        other.start()
+        other.join()
+        main = (x * 2).creator
+        leave.set()
+        t.join()
+        self.assertIsNone(results["quiet"])
+        self.assertIsNotNone(results["loud"])
+        self.assertIsNotNone(main)
+
+    def test_asyncio_tasks(self):
+        # 一个任务在no_grad()中等待时，另一个任务仍然构建计算图
+        x = Variable(np.array(1.0))
+
+        async def quiet(entered, leave):
+            with no_grad():
+                entered.set()
+                await leave.wait()
+                return (x * 2).creator
+
+        async def loud(entered, leave):
+            await entered.wait()
+            y = x * 2
+            leave.set()
+            return y.creator
+
+        async def main():
+            entered, leave = asyncio.Event(), asyncio.Event()
+            return await asyncio.gather(quiet(entered, leave), loud(entered, leave))
+
+        inside, outside = asyncio.run(main())
+        self.assertIsNone(inside)
+        self.assertIsNotNone(outside)
+        self.assertTrue(Config.enable_backprop)
+
+    def test_parallel_backprop_inherits_context(self):
+        # 线程池中的反向传播任务使用调用者的配置
+        Record.seen = []
+        x = Variable(np.array(1.0))
+        y = Record()(x) + Record()(x)
+        with using_config("elementwise_threshold", 7):
+            y.backward(workers=2)
+        self.assertEqual(x.grad.data, 4.0)
+        self.assertEqual(Record.seen, [7, 7])
+
+
+if __name__ == "__main__":
+    unittest.main()
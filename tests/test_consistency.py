@@ -0,0 +1,171 @@
+if "__file__" in globals():
+    import os, sys
+
+    sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+import unittest
+import numpy as np
+import dezero
+from dezero import Variable, BackwardPlan, Tape, using_config
+import dezero.functions as F
+
+
+def goldstein_elementwise(x, y):
+    return (1 + (x + y + 1) ** 2 * (19 - 14 * x + 3 * x**2 - 14 * y + 6 * x * y + 3 * y**2)) * (
+        30 + (2 * x - 3 * y) ** 2 * (18 - 32 * x + 12 * x**2 + 48 * y - 36 * x * y + 27 * y**2)
+    )
+
+
+def goldstein(x, y):
+    return F.sum(goldstein_elementwise(x, y))
+
+
+def mlp(x, W1, b1, W2):
+    return F.sum(F.matmul(F.tanh(F.matmul(x, W1) + b1), W2))
+
+
+def cases():
+    """(名字, 函数, 参数的ndarray)"""
+    rng = np.random.RandomState(0)
+    return [
+        ("goldstein", goldstein, [rng.uniform(-1, 1, 5), rng.uniform(-1, 1, 5)]),
+        ("mlp", mlp, [rng.randn(6, 3), rng.randn(3, 4), rng.randn(4), rng.randn(4, 2)]),
+    ]
+
+
+def eager(f, arrays, **kwargs):
+    """普通的backward得到的输出和梯度"""
+    xs = [Variable(a.copy()) for a in arrays]
+    y = f(*xs)
+    y.backward(**kwargs)
+    return y.data, [x.grad.data for x in xs]
+
+
+class BackwardConsistencyTest(unittest.TestCase):
+    def check(self, name, expected, actual):
+        (y0, gs0), (y1, gs1) = expected, actual
+        self.assertTrue(np.allclose(y0, y1), name)
+        for g0, g1 in zip(gs0, gs1):
+            self.assertTrue(np.allclose(g0, g1), name)
+
+    def test_engines(self):
+        for name, f, arrays in cases():
+            expected = eager(f, arrays)
+            self.check(name + " retain_graph", expected, eager(f, arrays, retain_graph=False))
+            self.check(name + " parallel", expected, eager(f, arrays, workers=2))
+            plan = BackwardPlan()
+            for _ in range(2):  # 第二次使用记录的顺序
+                self.check(name + " plan", expected, eager(f, arrays, plan=plan))
+            with using_config("simplify", False):
+                self.check(name + " create_graph", expected, eager(f, arrays, create_graph=True))
+            self.check(name + " simplify", expected, eager(f, arrays, create_graph=True))
+
+    def test_checkpoint(self):
+        for name, f, arrays in cases():
+            wrapped = lambda *xs: F.checkpoint(f, *xs)
+            self.check(name, eager(f, arrays), eager(wrapped, arrays))
+
+    def test_tape(self):
+        for name, f, arrays in cases():
+            xs = [Variable(a.copy()) for a in arrays]
+            tape = Tape()
+            with tape.recording():
+                y = f(*xs)
+            tape.backward(y)
+            self.check(name, eager(f, arrays), (y.data, [x.grad.data for x in xs]))
+
+    def test_jit(self):
+        for name, f, arrays in cases():
+            expected = eager(f, arrays)
+            for optimize in (False, True):
+                jf = dezero.jit(f, optimize=optimize)
+                for _ in range(2):  # 第二次回放缓存的Program
+                    self.check(name + " jit", expected, eager(jf, arrays))
+
+    def test_jit_captured(self):
+        # fn引用的外部参数作为额外的输入，梯度累积到它们的grad上
+        _, f, arrays = cases()[1]
+        y0, grads = eager(f, arrays)
+        params = [Variable(a.copy()) for a in arrays[1:]]
+        jf = dezero.jit(lambda x: f(x, *params))
+        for _ in range(2):
+            for p in params:
+                p.cleargrad()
+            y = jf(Variable(arrays[0]))
+            y.backward()
+            self.assertTrue(np.allclose(y.data, y0))
+            for g, p in zip(grads[1:], params):
+                self.assertTrue(np.allclose(p.grad.data, g))
+
+
+class TransformConsistencyTest(unittest.TestCase):
+    def test_jvp(self):
+        rng = np.random.RandomState(1)
+        for name, f, arrays in cases():
+            y0, grads = eager(f, arrays)
+            vs = [rng.randn(*a.shape) for a in arrays]
+            y, t = dezero.jvp(f, arrays, vs)
+            self.assertTrue(np.allclose(y.data, y0), name)
+            expected = sum(np.vdot(g, v) for g, v in zip(grads, vs))
+            self.assertTrue(np.allclose(t.data, expected), name)
+
+    def test_hvp(self):
+        rng = np.random.RandomState(2)
+        eps = 1e-5
+        for name, f, arrays in cases():
+            vs = [rng.randn(*a.shape) for a in arrays]
+            hvs = dezero.hvp(f, arrays, vs)
+            # 梯度沿v方向的中心差分
+            plus = eager(f, [a + eps * v for a, v in zip(arrays, vs)])[1]
+            minus = eager(f, [a - eps * v for a, v in zip(arrays, vs)])[1]
+            for hv, gp, gm in zip(hvs, plus, minus):
+                self.assertTrue(np.allclose(hv.data, (gp - gm) / (2 * eps), rtol=1e-4, atol=1e-4), name)
+
+    def test_hvp_matches_double_backward(self):
+        _, f, arrays = cases()[0]
+        x, y = [Variable(a.copy()) for a in arrays]
+        f(x, y).backward(create_graph=True)
+        gx = x.grad
+        x.cleargrad()
+        y.cleargrad()
+        F.sum(gx).backward()
+        hx, hy = dezero.hvp(f, arrays, [np.ones_like(arrays[0]), np.zeros_like(arrays[1])])
+        self.assertTrue(np.allclose(hx.data, x.grad.data))
+
+    def test_jacobian(self):
+        for name, f, arrays in cases():
+            _, grads = eager(f, arrays)
+            for mode in ("forward", "reverse"):
+                jacobians = dezero.jacobian(f, arrays, mode=mode)
+                for g, j in zip(grads, jacobians):
+                    self.assertTrue(np.allclose(j.data, g), name + " " + mode)
+
+    def test_vmap(self):
+        # 逐个样本的梯度之和等于整批的梯度
+        name, f, arrays = cases()[1]
+        x, params = arrays[0], arrays[1:]
+        _, grads = eager(f, arrays)
+        per_sample = dezero.vmap(lambda x, *ps: f(F.reshape(x, (1, 3)), *ps), (0, None, None, None))
+        losses = per_sample(x, *params)
+        self.assertEqual(losses.shape, (6,))
+        self.assertTrue(np.allclose(losses.data.sum(), eager(f, arrays)[0]))
+        gs = per_sample.grad(x, *params)
+        self.assertTrue(np.allclose(gs[0].data, grads[0]))
+        for g, expected in zip(gs[1:], grads[1:]):
+            self.assertTrue(np.allclose(g.data.sum(axis=0), expected))
+
+    def test_taylor(self):
+        # goldstein对x逐元素，一阶和二阶导数与backward(create_graph=True)相同
+        x0, y0 = cases()[0][2]
+        series = dezero.taylor(lambda x: goldstein_elementwise(x, y0), x0, 2)
+        x = Variable(x0.copy())
+        goldstein(x, y0).backward(create_graph=True)
+        gx = x.grad
+        x.cleargrad()
+        F.sum(gx).backward()
+        self.assertTrue(np.allclose(series[1].data, gx.data))
+        self.assertTrue(np.allclose(series[2].data, x.grad.data))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,39 @@
+if "__file__" in globals():
+    import os, sys
+
+    sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+import unittest
+import numpy as np
+from dezero import Variable, Constant, inference_mode
+import dezero.functions as F
+
+
+class Parameter(Variable):
+    __slots__ = ()
+
+
+class InferenceModeTest(unittest.TestCase):
+    def test_variable_subclasses(self):
+        # Variable的子类(Constant、用户定义的参数类型)同样要取出data
+        for cls in (Variable, Constant, Parameter):
+            x = cls(np.array([0.5, 1.0]))
+            with inference_mode():
+                y = F.sin(x)
+                z = x * x + 1
+            self.assertTrue(np.allclose(y.data, np.sin(x.data)))
+            self.assertTrue(np.allclose(z.data, x.data * x.data + 1))
+
+    def test_matches_default_mode(self):
+        rng = np.random.RandomState(0)
+        W = Parameter(rng.randn(3, 2))
+        x = Variable(rng.randn(4, 3))
+        expected = F.sum(F.tanh(F.matmul(x, W)), axis=1).data
+        with inference_mode():
+            y = F.sum(F.tanh(F.matmul(x, W)), axis=1)
+        self.assertIsNone(y.creator)
+        self.assertTrue(np.allclose(y.data, expected))
+
+
+if __name__ == "__main__":
+    unittest.main()
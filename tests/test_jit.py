@@ -0,0 +1,199 @@
+if "__file__" in globals():
+    import os, sys
+
+    sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+import functools
+import importlib
+import tempfile
+import threading
+import unittest
+import numpy as np
+import dezero
+from dezero import Variable, Function, using_config
+from dezero.jit import Program, CacheInfo
+import dezero.functions as F
+
+
+class JitAliasTest(unittest.TestCase):
+    def test_repeated_argument(self):
+        # 同一个变量作为两个参数传入时梯度只计算一次
+        for optimize in (False, True):
+            x = Variable(np.array(3.0))
+            y = dezero.jit(lambda a, b: a * b, optimize=optimize)(x, x)
+            y.backward()
+            self.assertEqual(y.data, 9.0)
+            self.assertEqual(x.grad.data, 6.0)
+
+    def test_alias_is_part_of_key(self):
+        jf = dezero.jit(lambda x, y: x * y + y)
+        x = Variable(np.array(3.0))
+        jf(x, x).backward()
+        self.assertEqual(x.grad.data, 7.0)
+
+        a, b = Variable(np.array(2.0)), Variable(np.array(5.0))
+        z = jf(a, b)
+        z.backward()
+        self.assertEqual(z.data, 15.0)
+        self.assertEqual(a.grad.data, 5.0)
+        self.assertEqual(b.grad.data, 3.0)
+        self.assertEqual(jf.cache_info().misses, 2)
+
+
+class JitConfigTest(unittest.TestCase):
+    def test_runtime_config_shares_trace(self):
+        # 不影响追踪结果的配置不会让同一个签名重新追踪
+        jf = dezero.jit(lambda x: x * x + 1)
+        x = Variable(np.arange(4.0))
+        expected = jf(x).data
+        for name, value in (
+            ("elementwise_threshold", 1),
+            ("elementwise_workers", 2),
+            ("simplify", False),
+        ):
+            with using_config(name, value):
+                self.assertTrue(np.allclose(jf(x).data, expected))
+        self.assertEqual(jf.cache_info().misses, 1)
+
+
+class ProgramRunTest(unittest.TestCase):
+    def test_no_grad_releases_slots(self):
+        # 没有内存规划时，不需要反向传播的执行在最后一次使用后释放中间结果
+        x = Variable(np.arange(3.0))
+        program = Program(lambda a: F.sum(F.tanh(a * 2) + a), [x])
+        values = program.run([x.data], train=False)
+        kept = [s for s, v in enumerate(values) if v is not None]
+        self.assertEqual(kept, program.output_slots)
+        self.assertTrue(np.allclose(values[kept[0]], np.sum(np.tanh(x.data * 2) + x.data)))
+        values = program.run([x.data], train=True)
+        self.assertTrue(all(v is not None for v in values))
+
+
+class Wait(Function):
+    """两个线程在backward中都读取inputs之后才继续，用来检查vjp是否修改共用的实例"""
+
+    __slots__ = ("barrier",)
+
+    def forward(self, x):
+        return x * 2
+
+    def backward(self, gy):
+        self.barrier.wait(timeout=5)
+        (x,) = self.inputs
+        self.barrier.wait(timeout=5)
+        return gy * x
+
+
+class TraceCacheTest(unittest.TestCase):
+    def test_lru_eviction(self):
+        traced = []
+
+        def fn(x):
+            traced.append(x.shape)  # 只在追踪时执行
+            return x * 2
+
+        jf = dezero.jit(fn, maxsize=2)
+        for n in (1, 2, 3, 1):
+            y = jf(Variable(np.ones(n)))
+            self.assertTrue(np.allclose(y.data, 2.0))
+        self.assertEqual(jf.cache_info(), CacheInfo(0, 4, 2, 2, 2))
+        self.assertEqual(traced, [(1,), (2,), (3,), (1,)])
+
+        jf(Variable(np.ones(3)))  # 最近使用过，仍然在缓存中
+        jf(Variable(np.ones(2)))  # 已经被淘汰，重新追踪
+        self.assertEqual(traced[4:], [(2,)])
+        self.assertEqual(jf.cache_info(), CacheInfo(1, 5, 3, 2, 2))
+
+
+class JitThreadTest(unittest.TestCase):
+    def test_shared_function_vjp(self):
+        # dezero.jit的Program在各次调用之间共用Function，两个线程同时调用vjp时互不影响
+        f = Wait()
+        f.barrier = threading.Barrier(2)
+        results = {}
+
+        def run(i):
+            results[i] = f.vjp((np.array(float(i)),), (None,), (np.array(1.0),))[0]
+
+        threads = [threading.Thread(target=run, args=(i,)) for i in (1, 2)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(results, {1: 1.0, 2: 2.0})
+
+
+class DiskCacheTest(unittest.TestCase):
+    def test_helper_change_invalidates_cache(self):
+        # fn调用的辅助函数被修改后，新的JitFunction(相当于新的进程)不能加载旧的Program
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "jit_helper.py")
+            with open(path, "w") as f:
+                f.write("def body(x):\n    return x * 2\n")
+            sys.path.insert(0, tmp)
+            try:
+                helper = importlib.import_module("jit_helper")
+
+                def fn(x):
+                    return helper.body(x) + 1
+
+                cache = os.path.join(tmp, "cache")
+                x = Variable(np.array(1.0))
+                self.assertEqual(dezero.jit(fn, cache_dir=cache)(x).data, 3.0)
+                self.assertEqual(len(os.listdir(cache)), 1)
+                self.assertEqual(dezero.jit(fn, cache_dir=cache)(x).data, 3.0)
+
+                with open(path, "w") as f:
+                    f.write("def body(x):\n    return x * 10\n")
+                importlib.reload(helper)
+                self.assertEqual(dezero.jit(fn, cache_dir=cache)(x).data, 11.0)
+            finally:
+                sys.path.remove(tmp)
+                sys.modules.pop("jit_helper", None)
+
+    def test_baked_values_are_part_of_key(self):
+        # 闭包变量、全局变量和partial的参数在Program中被固定为常量，值不同时不能共用缓存
+        def make(c):
+            def fn(x):
+                return x * c
+
+            return fn
+
+        def scale(x, c):
+            return x * c
+
+        namespace = {"w": np.array(2.0)}
+        exec("def fn(x):\n    return x * w\n", namespace)
+        x = Variable(np.array(1.0))
+        with tempfile.TemporaryDirectory() as cache:
+            self.assertEqual(dezero.jit(make(2.0), cache_dir=cache)(x).data, 2.0)
+            self.assertEqual(dezero.jit(make(3.0), cache_dir=cache)(x).data, 3.0)
+            self.assertEqual(dezero.jit(make(3.0), cache_dir=cache)(x).data, 3.0)
+
+            self.assertEqual(dezero.jit(namespace["fn"], cache_dir=cache)(x).data, 2.0)
+            namespace["w"] = np.array(5.0)
+            self.assertEqual(dezero.jit(namespace["fn"], cache_dir=cache)(x).data, 5.0)
+
+            for c in (2.0, 3.0):
+                jf = dezero.jit(functools.partial(scale, c=c), cache_dir=cache)
+                self.assertEqual(jf(x).data, c)
+            self.assertEqual(len(os.listdir(cache)), 6)
+
+    def test_unhashable_callable(self):
+        # 无法计算哈希的可调用对象不使用磁盘缓存
+        class Scale:
+            def __init__(self, c):
+                self.c = c
+
+            def __call__(self, x):
+                return x * self.c
+
+        x = Variable(np.array(1.0))
+        with tempfile.TemporaryDirectory() as cache:
+            for c in (2.0, 3.0):
+                self.assertEqual(dezero.jit(Scale(c), cache_dir=cache)(x).data, c)
+            self.assertEqual(os.listdir(cache), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+if "__file__" in globals():
+    import os, sys
+
+    sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+import unittest
+import numpy as np
+import dezero
+from dezero import Variable, using_config
+from dezero.core import Add, _config
+from dezero.parallel import CHUNK_SIZE
+import dezero.functions as F
+
+N = 3 * CHUNK_SIZE + 7  # 最后一块不满
+
+
+def run(f, arrays, threshold):
+    """返回f的输出和各个输入的梯度(ndarray)，threshold为None时不分块"""
+    xs = [Variable(a.copy()) for a in arrays]
+    with using_config("elementwise_threshold", threshold), using_config("elementwise_workers", 3):
+        y = f(*xs)
+        y.backward()
+    return y.data, [x.grad.data for x in xs]
+
+
+class ElementwiseChunkTest(unittest.TestCase):
+    def check(self, f, arrays):
+        (y0, gs0), (y1, gs1) = run(f, arrays, None), run(f, arrays, 1000)
+        self.assertEqual(y0.dtype, y1.dtype)
+        self.assertTrue(np.allclose(y0, y1))
+        for g0, g1 in zip(gs0, gs1):
+            self.assertEqual(g0.shape, g1.shape)
+            self.assertTrue(np.allclose(g0, g1))
+
+    def test_above_threshold(self):
+        rng = np.random.RandomState(0)
+        a, b = rng.randn(N), rng.randn(N)
+        with using_config("elementwise_threshold", 1000):
+            self.assertIsNotNone(dezero.parallel.elementwise(Add(), [a, b], _config.get()))
+        self.check(lambda x, y: F.tanh(x * y + 1) - F.sin(x) / (y**2 + 1), [a, b])
+
+    def test_int_promotion(self):
+        # 整数相除得到浮点数，分块时的输出dtype要与forward相同
+        self.check(lambda x, y: x / y, [np.arange(1, N + 1), np.full(N, 3)])
+
+    def test_scalar_broadcast(self):
+        rng = np.random.RandomState(1)
+        self.check(lambda x, c: x * c + 2.5, [rng.randn(N), np.array(3.0)])
+        self.check(lambda x, c: x - c, [rng.randn(N), np.ones(1)])
+
+    def test_fallback(self):
+        # 不连续的输入、需要真正广播的输入不分块，结果与普通的forward相同
+        rng = np.random.RandomState(2)
+        a = rng.randn(2 * N)[::2]
+        b = rng.randn(N)
+        c = rng.randn(2, N)
+        cases = [
+            (a, b),  # 不连续
+            (b, np.ones((1, 1))),  # 只有一个元素但维数更多，输出的形状是(1, N)
+            (b, c),  # 广播到(2, N)
+            (c.T.copy(), c.T),  # 转置后不连续
+        ]
+        with using_config("elementwise_threshold", 1000):
+            for x0, x1 in cases:
+                self.assertIsNone(dezero.parallel.elementwise(Add(), [x0, x1], _config.get()))
+        for x0, x1 in cases:
+            self.check(lambda x, y: x + y, [x0, x1])
+            self.check(lambda x, y: x * y, [x0, x1])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,85 @@
+if "__file__" in globals():
+    import os, sys
+
+    sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+import unittest
+import numpy as np
+import dezero
+from dezero import Function, Variable
+from dezero import codegen
+from dezero.passes import FusedElementwise
+import dezero.functions as F
+
+
+class Scale(Function):
+    """没有声明__slots__、参数保存在实例__dict__中的Function"""
+
+    def __init__(self, c):
+        self.c = c
+
+    def forward(self, x):
+        return x * self.c
+
+    def backward(self, gy):
+        return gy * self.c
+
+    def vjp(self, xs, ys, gys):
+        return (gys[0] * self.c,)
+
+    def forward_source(self, xs):
+        return "{} * {!r}".format(xs[0], self.c)
+
+    def vjp_source(self, xs, ys, gys):
+        return ("{} * {!r}".format(gys[0], self.c),)
+
+
+def scaled(x):
+    return Scale(2.0)(x) + Scale(3.0)(x)
+
+
+class CommonSubexpressionTest(unittest.TestCase):
+    def test_parameters_in_dict(self):
+        x = Variable(np.array(1.0))
+        y = dezero.jit(scaled)(x)
+        y.backward()
+        self.assertEqual(y.data, 5.0)
+        self.assertEqual(x.grad.data, 5.0)
+
+    def test_same_parameters_merged(self):
+        jf = dezero.jit(lambda x: Scale(2.0)(x) + Scale(2.0)(x))
+        self.assertEqual(jf(Variable(np.array(1.0))).data, 4.0)
+        self.assertEqual(len(jf.programs.values()[0]), 2)
+
+    def test_codegen(self):
+        module = codegen.load(codegen.generate(scaled, np.array(1.0)))
+        self.assertEqual(module.forward(np.array(1.0)), 5.0)
+
+
+def chain(x, y):
+    return F.tanh(x * y + 1) * x - y
+
+
+class FuseElementwiseTest(unittest.TestCase):
+    def test_saves_only_inputs(self):
+        # 融合后的运算只输出最终结果，反向传播由外部输入重新计算中间结果
+        rng = np.random.RandomState(0)
+        a, b = rng.randn(4), rng.randn(4)
+        x, y = Variable(a.copy()), Variable(b.copy())
+        chain(x, y).backward()
+        expected = x.grad.data, y.grad.data
+
+        jf = dezero.jit(chain)
+        for _ in range(2):
+            x, y = Variable(a.copy()), Variable(b.copy())
+            jf(x, y).backward()
+            self.assertTrue(np.allclose(x.grad.data, expected[0]))
+            self.assertTrue(np.allclose(y.grad.data, expected[1]))
+        nodes = jf.programs.values()[0].nodes
+        fused = [(f, outs) for f, _, outs in nodes if isinstance(f, FusedElementwise)]
+        self.assertEqual(len(fused), 1)
+        self.assertEqual(len(fused[0][1]), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()